@@ -1,13 +1,18 @@
+import argparse
+import hashlib
+import json
 import os
-from google import genai
+import sys
+import unicodedata
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from llm_clients import get_gemini_client
+from request_scheduler import call
+from response_cache import ResponseCache, cache_dir, make_key
 
-client = genai.Client()
+MODEL = "gemini-2.5-flash"
 
-while True:
-    word = input("Word?")
-    if not word:
-        break
-    prompt = f"""Provide a dictionary entry for the word '{word}' in JSON format.
+PROMPT_TEMPLATE = """Provide a dictionary entry for the word '{word}' in JSON format.
 
 If the word is in English, provide the Finnish translation as the 'word', definition in English, synonyms and antonyms in Finnish, examples in Finnish.
 
@@ -16,6 +21,252 @@ If the word is in Finnish, provide the word as is, definition in English, synony
 Output only valid JSON with keys: word (string), definition (string), synonyms (array of strings), antonyms (array of strings), examples (array of strings).
 
 No other text."""
-    response = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
+
+BATCH_PROMPT_TEMPLATE = """Provide dictionary entries for each of the following words in JSON format.
+
+Words (one per line):
+{words}
+
+Apply these rules to every word:
+If the word is in English, provide the Finnish translation as the 'word', definition in English, synonyms and antonyms in Finnish, examples in Finnish.
+
+If the word is in Finnish, provide the word as is, definition in English, synonyms and antonyms in Finnish, examples in Finnish.
+
+Output only a valid JSON array with one object per word, in the same order as the list. Each object must have the keys: query (the word exactly as given in the list), word (string), definition (string), synonyms (array of strings), antonyms (array of strings), examples (array of strings).
+
+No other text."""
+
+TEMPLATE_HASH = hashlib.sha256(PROMPT_TEMPLATE.encode("utf-8")).hexdigest()
+# Batch entries come from a different prompt (and carry a query field), so they are cached under their own hash
+BATCH_TEMPLATE_HASH = hashlib.sha256(BATCH_PROMPT_TEMPLATE.encode("utf-8")).hexdigest()
+
+# Batch mode settings
+MAX_ATTEMPTS = 3  # attempts per word before an error record is written
+
+def normalize_word(word):
+    """Normalizes a word so that 'Dog', ' dog ' and 'dog' share one cache entry."""
+    return " ".join(unicodedata.normalize("NFC", word).casefold().split())
+
+def lookup_word(word, cache=None):
+    """Returns the JSON dictionary entry for a word, using the cache when one is given."""
+    key = make_key(normalize_word(word), TEMPLATE_HASH, MODEL)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    prompt = PROMPT_TEMPLATE.format(word=word)
+    response = call(f"gemini:{MODEL}", get_gemini_client().models.generate_content, model=MODEL, contents=prompt)
     json_output = response.text.strip()
-    print(json_output)
\ No newline at end of file
+
+    if cache is not None and json_output:
+        cache.put(key, json_output)
+    return json_output
+
+def estimate_tokens(text):
+    """Rough token estimate (about four characters per token)."""
+    return len(text) // 4 + 1
+
+class BatchSizer:
+    """
+    Decides how many words go into one request so that the prompt and the
+    expected answer stay under a token budget. The expected answer size is
+    learned from the token usage of earlier responses.
+    """
+
+    def __init__(self, token_budget, max_words):
+        self.token_budget = token_budget
+        self.max_words = max_words
+        self.word_limit = max_words
+        self.tokens_per_entry = 200.0  # initial guess, refined from responses
+        self.base_tokens = estimate_tokens(BATCH_PROMPT_TEMPLATE)
+
+    def take(self, pending):
+        """Pops the next batch of words from the front of the `pending` deque."""
+        batch = []
+        tokens = self.base_tokens
+        while pending and len(batch) < self.word_limit:
+            cost = estimate_tokens(pending[0]) + 1.2 * self.tokens_per_entry
+            if batch and tokens + cost > self.token_budget:
+                break
+            batch.append(pending.popleft())
+            tokens += cost
+        return batch
+
+    def observe(self, output_tokens, entries):
+        """Updates the per-entry estimate after a successful request."""
+        if entries:
+            self.tokens_per_entry = 0.5 * self.tokens_per_entry + 0.5 * (output_tokens / entries)
+        self.word_limit = min(self.max_words, self.word_limit * 2)
+
+    def failed(self, batch_size):
+        """Halves the batch size after a failed or truncated request."""
+        self.word_limit = max(1, batch_size // 2)
+
+def parse_batch_response(text, words):
+    """Parses a JSON array answer and returns {word: entry} for the requested words."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find("\n") + 1:] if "\n" in text else text
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = next((value for value in data.values() if isinstance(value, list)), [])
+
+    wanted = {normalize_word(word): word for word in words}
+    results = {}
+    for i, entry in enumerate(data):
+        if not isinstance(entry, dict):
+            continue
+        query = entry.get("query")
+        if query is None and len(data) == len(words):
+            query = words[i]
+        word = wanted.get(normalize_word(str(query))) if query is not None else None
+        if word is not None:
+            results[word] = entry
+    return results
+
+def request_batch(words):
+    """Sends one request for many words. Returns ({word: entry}, output_tokens)."""
+    from google.genai import types
+
+    prompt = BATCH_PROMPT_TEMPLATE.format(words="\n".join(words))
+    response = call(
+        f"gemini:{MODEL}",
+        get_gemini_client().models.generate_content,
+        model=MODEL,
+        contents=prompt,
+        config=types.GenerateContentConfig(response_mime_type="application/json"),
+    )
+    text = response.text or ""
+    usage = getattr(response, "usage_metadata", None)
+    output_tokens = getattr(usage, "candidates_token_count", None) or estimate_tokens(text)
+    return parse_batch_response(text, words), output_tokens
+
+def read_words(source):
+    """Reads one word per line from a file, or from stdin when `source` is '-'."""
+    stream = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    try:
+        return [line.strip() for line in stream if line.strip()]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def write_cached(cache, key, word, write):
+    """Writes the cached entry of a normalized word (from a batch or a single lookup). Returns True if there was one."""
+    for template_hash in (BATCH_TEMPLATE_HASH, TEMPLATE_HASH):
+        cached = cache.get(make_key(key, template_hash, MODEL))
+        if cached is None:
+            continue
+        try:
+            write({**json.loads(cached), "query": word})
+            return True
+        except json.JSONDecodeError:
+            pass
+    return False
+
+def run_batch(words, out, cache, token_budget, max_words, workers):
+    """
+    Looks up many words with as few requests as possible and writes one JSON
+    line per word to `out` as soon as its batch has been parsed.
+    """
+    def write(record):
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+
+    # Drop duplicates and answer cached words straight away
+    pending = deque()
+    seen = set()
+    for word in words:
+        key = normalize_word(word)
+        if key in seen:
+            continue
+        seen.add(key)
+        if cache is not None and write_cached(cache, key, word, write):
+            continue
+        pending.append(word)
+
+    sizer = BatchSizer(token_budget, max_words)
+    attempts = Counter()
+    requests_sent = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        while pending or in_flight:
+            while pending and len(in_flight) < workers:
+                batch = sizer.take(pending)
+                in_flight[executor.submit(request_batch, batch)] = batch
+                requests_sent += 1
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                error = None
+                try:
+                    entries, output_tokens = future.result()
+                    sizer.observe(output_tokens, len(entries))
+                except Exception as e:
+                    entries, error = {}, e
+                    sizer.failed(len(batch))
+
+                missing = []
+                for word in batch:
+                    entry = entries.get(word)
+                    if entry is not None:
+                        entry["query"] = word
+                        write(entry)
+                        if cache is not None:
+                            cache.put(make_key(normalize_word(word), BATCH_TEMPLATE_HASH, MODEL),
+                                      json.dumps(entry, ensure_ascii=False))
+                        continue
+                    attempts[word] += 1
+                    if attempts[word] >= MAX_ATTEMPTS:
+                        write({"query": word, "error": str(error) if error else "missing from response"})
+                    else:
+                        missing.append(word)
+                # Retry missing words first, in smaller batches if the request failed
+                pending.extendleft(reversed(missing))
+
+    print(f"Batch finished: {len(seen)} words, {requests_sent} requests", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Finnish/English dictionary powered by Gemini.")
+    parser.add_argument('--cache-file', default=os.path.join(cache_dir(), "dictionary.sqlite3"), help='Path of the response cache database')
+    parser.add_argument('--ttl-days', type=float, default=30, help='Days before a cached entry expires')
+    parser.add_argument('--max-entries', type=int, default=50000, help='Maximum number of cached entries')
+    parser.add_argument('--no-cache', action='store_true', help='Always query the model')
+    parser.add_argument('-b', '--batch', metavar='FILE', help="Non-interactive batch mode: read one word per line from FILE ('-' for stdin)")
+    parser.add_argument('-o', '--output', help='JSON Lines output file for batch mode (default: stdout)')
+    parser.add_argument('--token-budget', type=int, default=8000, help='Approximate token budget per batch request')
+    parser.add_argument('--max-words', type=int, default=100, help='Maximum number of words per batch request')
+    parser.add_argument('--workers', type=int, default=4, help='Number of batch requests sent concurrently')
+    args = parser.parse_args(argv)
+
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache_file, ttl=args.ttl_days * 24 * 3600, max_entries=args.max_entries)
+
+    try:
+        if args.batch:
+            out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+            try:
+                run_batch(read_words(args.batch), out, cache, args.token_budget,
+                          max(1, args.max_words), max(1, args.workers))
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+            return
+
+        while True:
+            word = input("Word?")
+            if not word:
+                break
+            print(lookup_word(word, cache))
+    finally:
+        if cache is not None:
+            stats = cache.stats()
+            print(f"Cache: {stats['hits']} hits, {stats['misses']} misses "
+                  f"(hit rate {stats['hit_rate']:.0%}, avg hit {stats['avg_hit_us']:.0f} us, {stats['entries']} entries)", file=sys.stderr)
+            cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,35 @@
-from google import genai
-import markdown
-from xhtml2pdf import pisa
+import argparse
+import json
 import os
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+from llm_clients import get_gemini_client
+from request_scheduler import call
+from response_cache import ResponseCache, cache_dir, make_key
+from instrumentation import stage
 
-client = genai.Client()
+MODEL = "gemini-2.5-flash"
+MARKDOWN_EXTENSIONS = ["tables"]
+RENDER_VERSION = "1"  # bump when the Markdown extensions or the page style change
 
-topic = input("Enter topic for scientific article: ")
+HEADING = re.compile(r"^#{1,2}\s")
+DOI = re.compile(r"10\.\d{4,9}/[^\s)\]>]+")
+REFERENCES_MARKER = "REFERENCES:"
 
-prompt = f"""Generate a scientific article on the topic '{topic}' in Markdown format.
+HTML_TEMPLATE = """<html><head><meta charset="utf-8"><style>
+body {{ font-family: Helvetica; font-size: 11pt; }}
+table {{ margin: 8pt 0; }}
+th, td {{ border: 1px solid #888888; padding: 3pt; }}
+th {{ background-color: #eeeeee; }}
+</style></head><body>
+{body}
+</body></html>"""
+
+PROMPT_TEMPLATE = """Generate a scientific article on the topic '{topic}' in Markdown format.
 
 The article should have the following structure:
 - Abstract
@@ -22,19 +44,320 @@ Ensure the article is comprehensive and follows scientific writing standards.
 
 Output only the Markdown content, no other text."""
 
-response = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
-markdown_content = response.text.strip()
+OUTLINE_PROMPT = """Plan a comprehensive scientific article on the topic '{topic}'.
+
+Output only a JSON object with the keys:
+- title (string)
+- chapters (array of objects with the keys heading (string), summary (string, what the chapter covers)
+  and subchapters (array of strings))
+
+The first chapter is the Introduction and the last chapter is the Conclusions.
+Do not include the abstract or the references as chapters.{chapter_hint}"""
+
+CHAPTER_PROMPT = """You are writing one chapter of the scientific article '{title}'.
+
+Outline of the whole article:
+{outline}
+
+Write only chapter {number}: '{heading}' ({summary}) in Markdown.
+Start with the heading '## {heading}' and use '###' headings for the subchapters: {subchapters}.
+Include tables where appropriate. Use APA style for in-text citations and do not repeat content that
+belongs to the other chapters.
+
+After the chapter, output a line containing only '{marker}' followed by the full APA style reference
+list entries of the works cited in this chapter, one per line.
+
+Output only the Markdown content, no other text."""
+
+ABSTRACT_PROMPT = """Write the abstract (150-250 words) of the scientific article '{title}' with the outline below.
+Output only the abstract text, without a heading.
+
+{outline}"""
+
+class SectionSplitter:
+    """
+    Splits streamed Markdown into sections at level 1 and 2 headings. Headings
+    inside code blocks are ignored, and a ```markdown fence wrapped around the
+    whole answer is dropped.
+    """
+
+    def __init__(self):
+        self.pending = ""  # incomplete last line
+        self.lines = []  # lines of the current section
+        self.in_fence = False
+        self.wrapped = None  # unknown until the first non-empty line
+
+    def feed(self, text):
+        """Adds streamed text and returns the sections that it completed."""
+        lines = (self.pending + text).split("\n")
+        self.pending = lines.pop()
+        finished = []
+        for line in lines:
+            stripped = line.strip()
+            if self.wrapped is None and stripped:
+                self.wrapped = stripped.startswith("```")
+                if self.wrapped:
+                    continue
+            if stripped.startswith("```"):
+                if self.wrapped and not self.in_fence and stripped == "```":
+                    continue  # end of the wrapper
+                self.in_fence = not self.in_fence
+            elif not self.in_fence and HEADING.match(line) and any(l.strip() for l in self.lines):
+                finished.append("\n".join(self.lines) + "\n")
+                self.lines = []
+            self.lines.append(line)
+        return finished
+
+    def close(self):
+        """Returns the last section once the stream has ended."""
+        pending, self.pending = self.pending, ""
+        finished = self.feed(pending + "\n") if pending else []
+        rest = "\n".join(self.lines).strip("\n")
+        self.lines = []
+        return finished + ([rest + "\n"] if rest.strip() else [])
+
+def split_sections(text):
+    """Splits a complete Markdown document into sections."""
+    splitter = SectionSplitter()
+    return splitter.feed(text) + splitter.close()
+
+def stream_article(client, topic):
+    """Yields the article text in chunks as the model generates it."""
+    def open_stream():
+        # The request is only sent when the stream is first read, so retries cover the first chunk
+        stream = client.models.generate_content_stream(model=MODEL, contents=PROMPT_TEMPLATE.format(topic=topic))
+        return next(stream, None), stream
+
+    first, stream = call(f"gemini:{MODEL}", open_stream)
+    if first is not None:
+        yield first.text or ""
+    for chunk in stream:
+        yield chunk.text or ""
+
+def generate_text(client, prompt, config=None):
+    """Runs one non-streaming generation and returns the answer text."""
+    response = call(f"gemini:{MODEL}", client.models.generate_content, model=MODEL, contents=prompt, config=config)
+    return (response.text or "").strip()
+
+def generate_outline(client, topic, chapters=None):
+    """Returns the article outline: {"title": ..., "chapters": [{"heading", "summary", "subchapters"}]}."""
+    from google.genai import types
+    hint = f"\nUse {chapters} chapters." if chapters else ""
+    text = generate_text(client, OUTLINE_PROMPT.format(topic=topic, chapter_hint=hint),
+                         types.GenerateContentConfig(response_mime_type="application/json"))
+    outline = json.loads(text)
+    if not outline.get("chapters"):
+        raise ValueError("The outline has no chapters")
+    outline.setdefault("title", topic)
+    return outline
+
+def format_outline(outline):
+    lines = []
+    for number, chapter in enumerate(outline["chapters"], 1):
+        lines.append(f"{number}. {chapter['heading']}")
+        lines.extend(f"   - {sub}" for sub in chapter.get("subchapters", []))
+    return "\n".join(lines)
+
+def generate_chapter(client, outline, number):
+    """Writes one chapter. Returns (Markdown of the chapter, list of its references)."""
+    chapter = outline["chapters"][number - 1]
+    prompt = CHAPTER_PROMPT.format(
+        title=outline["title"], outline=format_outline(outline), number=number,
+        heading=chapter["heading"], summary=chapter.get("summary", ""),
+        subchapters=", ".join(chapter.get("subchapters", [])) or "as needed",
+        marker=REFERENCES_MARKER,
+    )
+    text = "".join(split_sections(generate_text(client, prompt)))  # drops a ```markdown wrapper
+    body, _, references = text.partition(REFERENCES_MARKER)
+    return body.strip() + "\n", [line for line in references.splitlines() if line.strip()]
+
+def reference_key(entry):
+    """Identity of a reference entry: its DOI, or its text without formatting and punctuation."""
+    doi = DOI.search(entry)
+    if doi:
+        return doi.group(0).rstrip(".").lower()
+    return re.sub(r"[^a-z0-9]", "", entry.lower())
+
+def merge_references(reference_lists):
+    """Merges the chapters' reference lists into one alphabetical APA list without duplicates."""
+    merged = {}
+    for references in reference_lists:
+        for entry in references:
+            entry = re.sub(r"^\s*(?:[-*+]|\d+\.)\s+", "", entry).strip()
+            key = reference_key(entry)
+            if key and key not in merged:
+                merged[key] = entry
+    return sorted(merged.values(), key=lambda entry: re.sub(r"[^a-z0-9 ]", "", entry.lower()))
+
+def generate_sectioned(client, topic, workers=4, chapters=None, timings=None):
+    """
+    Generates a long article in two phases: an outline first, then the abstract
+    and every chapter concurrently. Returns the assembled Markdown document.
+    """
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    outline = generate_outline(client, topic, chapters)
+    timings["outline"] = time.perf_counter() - start
+    print(f"Outline: {outline['title']} ({len(outline['chapters'])} chapters)")
+
+    count = len(outline["chapters"])
+    bodies, references = [None] * count, [None] * count
+    chapter_seconds = 0.0
+
+    def timed(fn, *args):
+        task_start = time.perf_counter()
+        return fn(*args), time.perf_counter() - task_start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        abstract = executor.submit(generate_text, client, ABSTRACT_PROMPT.format(title=outline["title"], outline=format_outline(outline)))
+        futures = {executor.submit(timed, generate_chapter, client, outline, number): number
+                   for number in range(1, count + 1)}
+        for future in as_completed(futures):
+            number = futures[future]
+            (bodies[number - 1], references[number - 1]), seconds = future.result()
+            chapter_seconds += seconds
+            print(f"  chapter {number}/{count} done in {seconds:.1f} s: {outline['chapters'][number - 1]['heading']}")
+        abstract_text = abstract.result()
+    timings["chapters"] = time.perf_counter() - start
+    timings["chapter_sum"] = chapter_seconds
+
+    merged = merge_references(references)
+    parts = [f"# {outline['title']}\n", f"## Abstract\n\n{abstract_text}\n", *bodies,
+             "## References\n\n" + "\n\n".join(merged) + "\n"]
+    print(f"References: {sum(len(r) for r in references)} cited, {len(merged)} after merging duplicates")
+    return "\n".join(parts)
+
+def render_section(section, cache=None):
+    """Converts one Markdown section to HTML, reusing the cached HTML when the section has not changed."""
+    key = make_key("article-section", RENDER_VERSION, section)
+    if cache is not None:
+        html = cache.get(key)
+        if html is not None:
+            return html, True
+    import markdown
+    with stage("markdown_render") as span:
+        html = markdown.markdown(section, extensions=MARKDOWN_EXTENSIONS)
+        span.add(bytes_in=len(section), bytes_out=len(html))
+    if cache is not None:
+        cache.put(key, html)
+    return html, False
+
+def render_pdf(fragments, filename, use_cache=True):
+    """
+    Writes the PDF of the rendered sections. The finished PDF is cached by the
+    hash of its HTML, so an unchanged article is not laid out again.
+    Returns True when the cached PDF was used.
+    """
+    html = HTML_TEMPLATE.format(body="\n".join(fragments))
+    cached = os.path.join(cache_dir(), "article_pdf", make_key(RENDER_VERSION, html) + ".pdf")
+    if use_cache and os.path.exists(cached):
+        shutil.copyfile(cached, filename)
+        return True
+
+    from xhtml2pdf import pisa
+    buffer = BytesIO()
+    with stage("pdf_render") as span:
+        result = pisa.CreatePDF(html, dest=buffer, encoding="utf-8")
+        span.add(bytes_in=len(html), bytes_out=buffer.tell())
+    if result.err:
+        raise RuntimeError(f"PDF rendering failed with {result.err} errors")
+    with open(filename, "wb") as f:
+        f.write(buffer.getvalue())
+    if use_cache:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp = f"{cached}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp, cached)
+    return False
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a scientific article as Markdown and PDF using Gemini.")
+    parser.add_argument("topic", nargs="?", help="Topic of the article (asked if not given)")
+    parser.add_argument("-o", "--output", default="scientific_article", help="Output file name without extension")
+    parser.add_argument("--from-markdown", metavar="FILE", help="Render an existing Markdown file instead of generating a new article")
+    parser.add_argument("--no-cache", action="store_true", help="Render every section and the PDF from scratch")
+    parser.add_argument("-s", "--sectioned", action="store_true",
+                        help="Generate an outline first and then the chapters in parallel (for long articles)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Chapters generated at the same time in sectioned mode")
+    parser.add_argument("--chapters", type=int, help="Number of chapters to ask for in sectioned mode")
+    args = parser.parse_args(argv)
+
+    md_file, pdf_file = f"{args.output}.md", f"{args.output}.pdf"
+    cache = None if args.no_cache else ResponseCache(os.path.join(cache_dir(), "article_sections.sqlite3"))
+    fragments = []
+    timings = {"html": 0.0}
+    cached_sections = 0
+    start = time.perf_counter()
+
+    def add_section(section):
+        nonlocal cached_sections
+        render_start = time.perf_counter()
+        html, hit = render_section(section, cache)
+        timings["html"] += time.perf_counter() - render_start
+        cached_sections += hit
+        fragments.append(html)
+        print(f"  rendered: {section.splitlines()[0][:70]}{' (cached)' if hit else ''}")
+
+    try:
+        if args.from_markdown:
+            with open(args.from_markdown, encoding="utf-8") as f:
+                for section in split_sections(f.read()):
+                    add_section(section)
+            timings["generation"] = time.perf_counter() - start
+        elif args.sectioned:
+            topic = args.topic or input("Enter topic for scientific article: ")
+            article = generate_sectioned(get_gemini_client(), topic, args.workers, args.chapters, timings)
+            with open(md_file, "w", encoding="utf-8") as out:
+                out.write(article)
+            timings["generation"] = time.perf_counter() - start
+            print(f"Markdown article generated and saved as '{md_file}'")
+            for section in split_sections(article):
+                add_section(section)
+        else:
+            topic = args.topic or input("Enter topic for scientific article: ")
+            client = get_gemini_client()
+            splitter = SectionSplitter()
+            # Sections are written and rendered as soon as the next heading arrives
+            with open(md_file, "w", encoding="utf-8") as out:
+                for chunk in stream_article(client, topic):
+                    if "first_token" not in timings:
+                        timings["first_token"] = time.perf_counter() - start
+                    for section in splitter.feed(chunk):
+                        out.write(section)
+                        out.flush()
+                        add_section(section)
+                for section in splitter.close():
+                    out.write(section)
+                    add_section(section)
+            timings["generation"] = time.perf_counter() - start
+            print(f"Markdown article generated and saved as '{md_file}'")
 
-# Save Markdown to file
-with open('scientific_article.md', 'w', encoding='utf-8') as f:
-    f.write(markdown_content)
+        if not fragments:
+            print("The article is empty, no PDF generated.")
+            return
 
-print("Markdown article generated and saved as 'scientific_article.md'")
+        pdf_start = time.perf_counter()
+        pdf_cached = render_pdf(fragments, pdf_file, use_cache=cache is not None)
+        timings["pdf"] = time.perf_counter() - pdf_start
+        print(f"PDF generated as '{pdf_file}'")
+    finally:
+        if cache is not None:
+            cache.close()
 
-# Convert Markdown to HTML
-html = markdown.markdown(markdown_content)
+    # Markdown rendering overlaps with generation, so the stages do not add up to the total
+    print("\nTiming:", file=sys.stderr)
+    if "first_token" in timings:
+        print(f"  first token      {timings['first_token']:7.2f} s", file=sys.stderr)
+    if "outline" in timings:
+        print(f"  outline          {timings['outline']:7.2f} s", file=sys.stderr)
+        print(f"  chapters         {timings['chapters']:7.2f} s ({timings['chapter_sum']:.2f} s if generated one by one)", file=sys.stderr)
+    label = "read markdown" if args.from_markdown else "generation"
+    print(f"  {label:<16} {timings['generation']:7.2f} s", file=sys.stderr)
+    print(f"  markdown->html   {timings['html']:7.2f} s ({len(fragments)} sections, {cached_sections} cached)", file=sys.stderr)
+    print(f"  pdf              {timings['pdf']:7.2f} s{' (cached)' if pdf_cached else ''}", file=sys.stderr)
+    print(f"  total            {time.perf_counter() - start:7.2f} s", file=sys.stderr)
 
-# Generate PDF from HTML
-with open('scientific_article.pdf', 'wb') as f:
-    pisa.CreatePDF(html, dest=f)
-print("PDF generated as 'scientific_article.pdf'")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
-import os
-from openai import OpenAI
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llm_clients import get_openrouter_client, stream_chat_completion, format_stream_stats
+from request_scheduler import call
 
-def generate_creative_content(prompt, model, temperature, top_p, presence_penalty, frequency_penalty):
+def generate_creative_content(prompt, model, temperature, top_p, presence_penalty, frequency_penalty, out=None):
     """
     Generates creative content using the OpenAI API with specific parameters.
+    If `out` is given, the response is streamed to it token by token.
     """
     try:
-        client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=os.environ.get("OPENROUTER_API_KEY"),
-        )
+        client = get_openrouter_client()
 
         system_prompt = (
             "You are a creative writer, an expert in crafting compelling and SEO-optimized content. "
@@ -20,7 +21,7 @@ def generate_creative_content(prompt, model, temperature, top_p, presence_penalt
             "The final output should be a polished piece of content ready for publication."
         )
 
-        response = client.chat.completions.create(
+        params = dict(
             model=model,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -31,15 +32,53 @@ def generate_creative_content(prompt, model, temperature, top_p, presence_penalt
             presence_penalty=presence_penalty,
             frequency_penalty=frequency_penalty,
         )
+
+        if out is not None:
+            content, stats = stream_chat_completion(client, out, provider="openrouter", **params)
+            print(f"\n[{format_stream_stats(stats)}]", file=sys.stderr)
+            return content
+
+        response = call(f"openrouter:{model}", client.chat.completions.create, **params)
         return response.choices[0].message.content
 
     except Exception as e:
-        return f"An error occurred: {e}"
+        message = f"An error occurred: {e}"
+        if out is not None:
+            out.write(message)
+        return message
+
+def generate_versions(prompt, model, configs, max_workers):
+    """
+    Generates one piece of content per config concurrently.
+    Yields (version_number, content) tuples in the order the requests finish.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                generate_creative_content,
+                prompt=prompt,
+                model=model,
+                temperature=config["temperature"],
+                top_p=config["top_p"],
+                presence_penalty=config["presence_penalty"],
+                frequency_penalty=config["frequency_penalty"],
+            ): i + 1
+            for i, config in enumerate(configs)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
 
-def main():
+def main(argv=None):
     """
     Main function to run an interactive loop for content generation.
     """
+    parser = argparse.ArgumentParser(description="Generate creative content with several parameter configurations.")
+    parser.add_argument("-w", "--max-workers", type=int, default=3,
+                        help="Maximum number of concurrent requests (1 runs the versions one after another)")
+    parser.add_argument("-s", "--stream", action="store_true",
+                        help="Stream each version token by token (versions are generated one after another)")
+    args = parser.parse_args(argv)
+
     # Define different configurations for content generation
     configs = [
         {"temperature": 0.7, "top_p": 0.9, "presence_penalty": 0.5, "frequency_penalty": 0.5},
@@ -56,16 +95,24 @@ def main():
 
         print(f"Generating content for prompt: '{prompt}'\n")
 
-        for i, config in enumerate(configs):
-            print(f"--- Version {i+1} ---")
-            content = generate_creative_content(
-                prompt=prompt,
-                model=model,
-                temperature=config["temperature"],
-                top_p=config["top_p"],
-                presence_penalty=config["presence_penalty"],
-                frequency_penalty=config["frequency_penalty"],
-            )
+        if args.stream:
+            for i, config in enumerate(configs):
+                print(f"--- Version {i+1} ---")
+                generate_creative_content(
+                    prompt=prompt,
+                    model=model,
+                    temperature=config["temperature"],
+                    top_p=config["top_p"],
+                    presence_penalty=config["presence_penalty"],
+                    frequency_penalty=config["frequency_penalty"],
+                    out=sys.stdout,
+                )
+                print("\n")
+            continue
+
+        # Send all versions at once and print each one as soon as it is ready
+        for version, content in generate_versions(prompt, model, configs, max(1, args.max_workers)):
+            print(f"--- Version {version} ---")
             print(content)
             print("\n")
 
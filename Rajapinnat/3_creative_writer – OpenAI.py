@@ -1,14 +1,25 @@
-import os
-from openai import OpenAI
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llm_clients import get_openai_client, stream_chat_completion, format_stream_stats
+from request_scheduler import call
 
-def generate_creative_content(prompt, model, temperature, top_p, presence_penalty, frequency_penalty):
+MODEL = "gpt-3.5-turbo"
+
+# Different configurations for content generation, one version each
+CONFIGS = [
+    {"temperature": 0.7, "top_p": 0.9, "presence_penalty": 0.5, "frequency_penalty": 0.5},
+    {"temperature": 0.9, "top_p": 1.0, "presence_penalty": 0.2, "frequency_penalty": 0.2},
+    {"temperature": 0.5, "top_p": 0.8, "presence_penalty": 0.8, "frequency_penalty": 0.8},
+]
+
+def generate_creative_content(prompt, model, temperature, top_p, presence_penalty, frequency_penalty, out=None):
     """
     Generates creative content using the OpenAI API with specific parameters.
+    If `out` is given, the response is streamed to it token by token.
     """
     try:
-        client = OpenAI(
-            api_key=os.environ.get("OPENAI_API_KEY"),
-        )
+        client = get_openai_client()
 
         system_prompt = (
             "You are a creative writer, an expert in crafting compelling and SEO-optimized content. "
@@ -19,7 +30,7 @@ def generate_creative_content(prompt, model, temperature, top_p, presence_penalt
             "The final output should be a polished piece of content ready for publication."
         )
 
-        response = client.chat.completions.create(
+        params = dict(
             model=model,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -30,23 +41,55 @@ def generate_creative_content(prompt, model, temperature, top_p, presence_penalt
             presence_penalty=presence_penalty,
             frequency_penalty=frequency_penalty,
         )
+
+        if out is not None:
+            content, stats = stream_chat_completion(client, out, provider="openai", **params)
+            print(f"\n[{format_stream_stats(stats)}]", file=sys.stderr)
+            return content
+
+        response = call(f"openai:{model}", client.chat.completions.create, **params)
         return response.choices[0].message.content
 
     except Exception as e:
-        return f"An error occurred: {e}"
+        message = f"An error occurred: {e}"
+        if out is not None:
+            out.write(message)
+        return message
 
-def main():
+def generate_versions(prompt, model, configs, max_workers):
+    """
+    Generates one piece of content per config concurrently.
+    Yields (version_number, content) tuples in the order the requests finish.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                generate_creative_content,
+                prompt=prompt,
+                model=model,
+                temperature=config["temperature"],
+                top_p=config["top_p"],
+                presence_penalty=config["presence_penalty"],
+                frequency_penalty=config["frequency_penalty"],
+            ): i + 1
+            for i, config in enumerate(configs)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def main(argv=None):
     """
     Main function to run an interactive loop for content generation.
     """
-    # Define different configurations for content generation
-    configs = [
-        {"temperature": 0.7, "top_p": 0.9, "presence_penalty": 0.5, "frequency_penalty": 0.5},
-        {"temperature": 0.9, "top_p": 1.0, "presence_penalty": 0.2, "frequency_penalty": 0.2},
-        {"temperature": 0.5, "top_p": 0.8, "presence_penalty": 0.8, "frequency_penalty": 0.8},
-    ]
+    parser = argparse.ArgumentParser(description="Generate creative content with several parameter configurations.")
+    parser.add_argument("-w", "--max-workers", type=int, default=3,
+                        help="Maximum number of concurrent requests (1 runs the versions one after another)")
+    parser.add_argument("-s", "--stream", action="store_true",
+                        help="Stream each version token by token (versions are generated one after another)")
+    args = parser.parse_args(argv)
 
-    model = "gpt-3.5-turbo"
+    configs = CONFIGS
+    model = MODEL
 
     while True:
         prompt = input("Enter a subject (or 'quit'/'exit' to stop): ")
@@ -55,16 +98,24 @@ def main():
 
         print(f"Generating content for prompt: '{prompt}'\n")
 
-        for i, config in enumerate(configs):
-            print(f"--- Version {i+1} ---")
-            content = generate_creative_content(
-                prompt=prompt,
-                model=model,
-                temperature=config["temperature"],
-                top_p=config["top_p"],
-                presence_penalty=config["presence_penalty"],
-                frequency_penalty=config["frequency_penalty"],
-            )
+        if args.stream:
+            for i, config in enumerate(configs):
+                print(f"--- Version {i+1} ---")
+                generate_creative_content(
+                    prompt=prompt,
+                    model=model,
+                    temperature=config["temperature"],
+                    top_p=config["top_p"],
+                    presence_penalty=config["presence_penalty"],
+                    frequency_penalty=config["frequency_penalty"],
+                    out=sys.stdout,
+                )
+                print("\n")
+            continue
+
+        # Send all versions at once and print each one as soon as it is ready
+        for version, content in generate_versions(prompt, model, configs, max(1, args.max_workers)):
+            print(f"--- Version {version} ---")
             print(content)
             print("\n")
 
@@ -1,67 +1,188 @@
 import argparse
 import sys
 import os
-from markitdown import MarkItDown
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from chunking import count_tokens, pack, split_markdown
+from document_loader import convert_sources
+from llm_clients import get_openai_client, stream_chat_completion, format_stream_stats
+from request_scheduler import call
 
-def main():
+MODEL = "gpt-3.5-turbo"  # or gpt-4, depending on preference
+
+MAP_INSTRUCTION = ("The content below is one part of a larger input. Answer based on this part only; "
+                   "the partial answers will be combined afterwards.")
+REDUCE_INSTRUCTION = ("Below are partial answers, each produced from a different part of the input. "
+                      "Combine them into a single, coherent final answer without repeating yourself.")
+MAP_CITATIONS = " Mark every statement with the source tag (for example [S1]) of the text it comes from."
+REDUCE_CITATIONS = " Keep the source tags such as [S1] as citations."
+
+def ask(client, prompt, max_tokens):
+    """Sends a single prompt and returns the answer text."""
+    response = call(
+        f"openai:{MODEL}",
+        client.chat.completions.create,
+        model=MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=max_tokens,
+    )
+    return response.choices[0].message.content
+
+def map_reduce(client, query, chunks, citations, chunk_tokens, max_tokens, workers, verbose=False):
+    """
+    Runs the query on every chunk concurrently (map), then combines the partial
+    answers until they fit into one request. Returns the prompt for the final
+    reduce request, which the caller sends so that it can be streamed.
+    """
+    map_prompts = [
+        f"{query}\n\n{MAP_INSTRUCTION}{MAP_CITATIONS if citations else ''}\n\n{chunk}"
+        for chunk in chunks
+    ]
+    reduce_header = f"{query}\n\n{REDUCE_INSTRUCTION}{REDUCE_CITATIONS if citations else ''}\n\n"
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if verbose:
+            print(f"Map: querying {len(map_prompts)} chunks", file=sys.stderr)
+        partials = list(executor.map(lambda p: ask(client, p, max_tokens), map_prompts))
+
+        # Intermediate reduce rounds for very large inputs
+        budget = chunk_tokens - count_tokens(reduce_header)
+        while len(partials) > 1 and count_tokens("\n\n---\n\n".join(partials)) > budget:
+            groups = pack(partials, budget, separator="\n\n---\n\n")
+            if len(groups) == len(partials):
+                break
+            if verbose:
+                print(f"Reduce: combining {len(partials)} partial answers into {len(groups)}", file=sys.stderr)
+            prompts = [reduce_header + "\n\n---\n\n".join(group) for group in groups]
+            partials = list(executor.map(lambda p: ask(client, p, max_tokens), prompts))
+
+    return reduce_header + "\n\n---\n\n".join(partials)
+
+def prepare_request(client, documents, query, citations=False, chunk_tokens=12000, max_tokens=1000, workers=4, verbose=False):
+    """
+    Builds the final request for `documents`, a list of (source, text) pairs.
+    Inputs larger than one request are summarized with map-reduce first.
+    Returns (request parameters, source list to append to the answer).
+    """
+    combined_content = "\n\n".join(text for _, text in documents)
+
+    # With citations every source gets a tag such as [S1] that the answer can refer to
+    tags = {}
+    for input_source, _ in documents:
+        tags.setdefault(input_source, len(tags) + 1)
+    sources = ""
+    if citations:
+        combined_content = "\n\n".join(f"[S{tags[source]}] Source: {source}\n\n{text}" for source, text in documents)
+        sources = "\n\nSources:\n" + "\n".join(f"[S{tag}] {source}" for source, tag in tags.items())
+
+    # Prepare the prompt
+    prompt = f"{query}\n\n{combined_content}"
+
+    if citations:
+        prompt += "\n\nInclude citations where applicable, using the source tags such as [S1]."
+
+    # Inputs larger than one request are chunked at heading boundaries and summarized with map-reduce
+    if count_tokens(prompt) > chunk_tokens:
+        chunk_size = max(500, chunk_tokens - count_tokens(query) - count_tokens(MAP_INSTRUCTION + MAP_CITATIONS) - 50)
+        chunks = []
+        for source, text in documents:
+            for chunk in split_markdown(text, chunk_size):
+                chunks.append(f"[S{tags[source]}] Source: {source}\n\n{chunk}" if citations else chunk)
+        prompt = map_reduce(client, query, chunks, citations, chunk_tokens, max_tokens, max(1, workers), verbose)
+
+    params = dict(
+        model=MODEL,
+        messages=[
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=max_tokens
+    )
+    return params, sources
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description='A command line tool to process text, html, csv, docx, or PDF files and query an LLM.')
-    parser.add_argument('inputs', nargs='*', help='Input sources: file paths or URLs')
+    parser.add_argument('inputs', nargs='*', help='Input sources: file paths or URLs (optional with --index)')
     parser.add_argument('-f', '--file', help='Output file to write the result')
     parser.add_argument('-q', '--query', default='Summarize the following content:', help='Query prompt for the LLM')
     parser.add_argument('-c', '--citations', action='store_true', help='Include citations in the output')
-    parser.add_argument('-r', '--reset', action='store_true', help='Reset the input data')
+    parser.add_argument('-r', '--reset', action='store_true', help='Reset the input data (ignore cached conversions)')
     parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
+    parser.add_argument('-s', '--stream', action='store_true', help='Stream the answer as it is generated')
+    parser.add_argument('--chunk-tokens', type=int, default=12000, help='Largest prompt sent in one request; larger inputs are chunked and summarized with map-reduce')
+    parser.add_argument('--max-tokens', type=int, default=1000, help='Maximum tokens per answer')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='Number of chunks queried concurrently')
+    parser.add_argument('--index', metavar='DIR', help='Add the inputs to a local embedding index in DIR and send only the most relevant chunks')
+    parser.add_argument('-k', '--top-k', type=int, default=8, help='Number of chunks retrieved from the index')
+    parser.add_argument('--embeddings', choices=['openai', 'local'], help='Embedding model for a new index (default: openai if OPENAI_API_KEY is set, otherwise local)')
 
-    if len(sys.argv) == 1:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
         parser.print_help()
         sys.exit(0)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    # Initialize MarkItDown
-    markitdown = MarkItDown()
+    # Convert all inputs in parallel, reusing cached conversions
+    documents = []
+    for input_source, text, error in convert_sources(args.inputs, use_cache=not args.reset, verbose=args.verbose):
+        if error is not None:
+            print(f"Error processing {input_source}: {error}", file=sys.stderr)
+            continue
+        documents.append((input_source, text))
+
+    # Retrieval mode: index new inputs, then keep only the chunks closest to the query
+    if args.index:
+        from embedding_index import EmbeddingIndex  # needs numpy, only imported when used
 
-    # Collect content from all inputs
-    combined_content = ""
-    for input_source in args.inputs:
-        if args.verbose:
-            print(f"Processing: {input_source}", file=sys.stderr)
         try:
-            if input_source.startswith('http://') or input_source.startswith('https://'):
-                # It's a URL
-                result = markitdown.convert_url(input_source)
-            else:
-                # It's a file
-                result = markitdown.convert(input_source)
-            combined_content += result.text_content + "\n\n"
+            index = EmbeddingIndex(args.index, args.embeddings)
+            for input_source, text in documents:
+                added = index.add(input_source, text)
+                if args.verbose:
+                    print(f"Indexed: {input_source} ({added} new chunks)", file=sys.stderr)
+            documents = [(hit["source"], hit["text"]) for hit in index.search(args.query, args.top_k)]
         except Exception as e:
-            print(f"Error processing {input_source}: {e}", file=sys.stderr)
-            continue
+            print(f"Error using index {args.index}: {e}", file=sys.stderr)
+            sys.exit(1)
+        if args.verbose:
+            print(f"Retrieved {len(documents)} chunks from {args.index}", file=sys.stderr)
 
-    if not combined_content.strip():
+    if not any(text.strip() for _, text in documents):
         print("No content to process.", file=sys.stderr)
         sys.exit(1)
 
-    # Initialize OpenAI client
-    client = OpenAI()
+    # Get the shared OpenAI client
+    client = get_openai_client()
 
-    # Prepare the prompt
-    prompt = f"{args.query}\n\n{combined_content}"
+    try:
+        params, sources = prepare_request(client, documents, args.query, args.citations, args.chunk_tokens,
+                                          args.max_tokens, args.workers, args.verbose)
+    except Exception as e:
+        print(f"Error querying LLM: {e}", file=sys.stderr)
+        sys.exit(1)
 
-    if args.citations:
-        prompt += "\n\nInclude citations where applicable."
+    # Stream the answer straight to the output file or stdout
+    if args.stream:
+        out = open(args.file, 'w', encoding='utf-8') if args.file else sys.stdout
+        try:
+            _, stats = stream_chat_completion(client, out, **params)
+            out.write(sources)
+        except Exception as e:
+            print(f"Error querying LLM: {e}", file=sys.stderr)
+            sys.exit(1)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if out is sys.stdout:
+            print()
+        print(format_stream_stats(stats), file=sys.stderr)
+        if args.file and args.verbose:
+            print(f"Output written to {args.file}", file=sys.stderr)
+        return
 
     # Query the LLM
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",  # or gpt-4, depending on preference
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1000
-        )
-        result = response.choices[0].message.content
+        response = call(f"openai:{MODEL}", client.chat.completions.create, **params)
+        result = response.choices[0].message.content + sources
     except Exception as e:
         print(f"Error querying LLM: {e}", file=sys.stderr)
         sys.exit(1)
@@ -1,109 +1,273 @@
 import argparse
+import asyncio
 import base64
 import os
-from openai import OpenAI
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from llm_clients import get_openai_client, get_http_session, http_timeout
+from request_scheduler import CircuitOpenError, call
+from image_preprocessing import prepare_image, OPENAI_VISION
+from output_store import OutputStore
+from image_store import ImageStore, request_key
+from instrumentation import stage
 
-def find_new_file_name(base_name):
-    """Finds a new file name to avoid overwriting existing files."""
-    name, ext = os.path.splitext(base_name)
-    i = 0
-    while os.path.exists(base_name):
-        i += 1
-        base_name = f"{name}_{i}{ext}"
-    return base_name
-
-def save_binary_file(data, filename):
-    """Saves binary data to a file."""
-    try:
-        with open(filename, "wb") as f:
-            f.write(data)
-        return True
-    except IOError as e:
-        print(f"Error saving file {filename}: {e}")
-        return False
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
 
 def fetch_url(url):
     """Fetches content from a URL."""
     try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for bad status codes
+        with stage("image_download"):  # the bytes are counted by the nested "api.download" stage
+            response = call("download", get_http_session().get, url, timeout=http_timeout())
+            response.raise_for_status()  # Raise an exception for bad status codes
         return response.content
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, CircuitOpenError) as e:
         print(f"Error fetching URL {url}: {e}")
         return None
 
-def main():
+def describe_image(client, image_path):
+    """Describes an image with gpt-4o-mini in a form suitable as an image generation prompt."""
+    # Downscale and encode the image (the model does not use more than 2048x768 anyway)
+    image_data, mime_type = prepare_image(image_path, **OPENAI_VISION)
+    base64_image = base64.b64encode(image_data).decode("utf-8")
+    response = call(
+        "openai:gpt-4o-mini",
+        client.chat.completions.create,
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Describe this image in a detailed and creative way, suitable as a prompt for an image generation model."},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:{mime_type};base64,{base64_image}"},
+                    },
+                ],
+            }
+        ],
+        max_tokens=300,
+    )
+    return response.choices[0].message.content
+
+def generate_image(client, description):
+    """Generates an image from a description with dall-e-3 and returns its URL."""
+    response = call(
+        "openai:dall-e-3",
+        client.images.generate,
+        model="dall-e-3",
+        prompt=description,
+        size="1024x1024",
+        quality="standard",
+        n=1,
+    )
+    return response.data[0].url
+
+def image_key(description):
+    """Image store key of the generate_image() request for `description`."""
+    return request_key("dall-e-3", description, "1024x1024", "standard")
+
+def output_name(image_path):
+    name, _ = os.path.splitext(os.path.basename(image_path))
+    return f"{name}_generated.png"
+
+def save_generated_image(store, images, data, image_path, description):
+    """
+    Stores the generated image in the image store and links it as
+    <input name>_generated.png (numbered if taken). Returns its path.
+    """
+    blob = images.put(image_key(description), data, prompt=description)
+    return store.link(blob, output_name(image_path), prompt=description, source=image_path)
+
+def reuse_generated_image(store, images, image_path, description):
+    """Links an image generated earlier from the same description, if stored. Returns its path or None."""
+    return images.export(image_key(description), store, output_name(image_path), description, source=image_path)
+
+class StageStats:
+    """Item counts and timing of one pipeline stage."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.done = 0
+        self.failed = 0
+        self.busy = 0.0  # summed over the workers
+        self.first_start = None
+        self.last_end = None
+
+    def report(self):
+        active = (self.last_end - self.first_start) if self.first_start is not None else 0.0
+        throughput = self.done / active * 60 if active else 0.0
+        utilization = self.busy / (active * self.workers) if active else 0.0
+        return (f"{self.name:<10}{self.workers:>8}{self.done:>6}{self.failed:>7}{self.busy:>9.1f}"
+                f"{active:>9.1f}{throughput:>10.1f}{utilization:>7.0%}")
+
+async def run_stage(fn, inbox, outbox, stats, next_workers=0):
+    """
+    Runs `fn` on every job from `inbox` with `stats.workers` concurrent workers
+    and passes the results on to `outbox`. The blocking API calls run in threads.
+    Stops when every worker has received a None, then sends one None per next stage worker.
+    """
+    async def worker():
+        while (job := await inbox.get()) is not None:
+            start = time.perf_counter()
+            if stats.first_start is None:
+                stats.first_start = start
+            try:
+                job = await asyncio.to_thread(fn, job)
+            except Exception as e:
+                stats.failed += 1
+                print(f"[{stats.name}] {job['source']}: {e}")
+                job = None
+            else:
+                stats.done += 1
+            finally:
+                stats.last_end = time.perf_counter()
+                stats.busy += stats.last_end - start
+            if job is not None and outbox is not None:
+                await outbox.put(job)  # waits while the next stage is behind
+
+    await asyncio.gather(*(worker() for _ in range(stats.workers)))
+    for _ in range(next_workers):
+        await outbox.put(None)
+
+async def run_pipeline(client, paths, output_dir, describe_workers, generate_workers, download_workers, queue_size, force=False):
+    """
+    Describes, generates and downloads the images as three concurrent stages
+    joined by bounded queues, so image N+1 is described while image N is being
+    generated and image N-1 downloaded. Returns the stats of each stage.
+    """
+    # Enough threads for every stage worker to block on a request at the same time
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=describe_workers + generate_workers + download_workers))
+
+    to_describe = asyncio.Queue(queue_size)
+    to_generate = asyncio.Queue(queue_size)
+    to_download = asyncio.Queue(queue_size)
+    store = OutputStore(output_dir)  # safe to share between the download workers
+    images = ImageStore()
+    describe = StageStats("describe", describe_workers)
+    generate = StageStats("generate", generate_workers)
+    download = StageStats("download", download_workers)
+
+    def describe_job(job):
+        job["description"] = describe_image(client, job["source"])
+        return job
+
+    def generate_job(job):
+        # Descriptions generated before are not paid for again
+        job["file"] = None if force else reuse_generated_image(store, images, job["source"], job["description"])
+        if job["file"] is None:
+            job["url"] = generate_image(client, job["description"])
+        return job
+
+    def download_job(job):
+        if job["file"] is not None:
+            print(f"{job['source']} -> {job['file']} (reused)")
+            return job
+        data = fetch_url(job["url"])
+        if data is None:
+            raise IOError("download failed")
+        filename = save_generated_image(store, images, data, job["source"], job["description"])
+        print(f"{job['source']} -> {filename}")
+        return job
+
+    async def feed():
+        for path in paths:
+            await to_describe.put({"source": path})
+        for _ in range(describe_workers):
+            await to_describe.put(None)
+
+    await asyncio.gather(
+        feed(),
+        run_stage(describe_job, to_describe, to_generate, describe, generate_workers),
+        run_stage(generate_job, to_generate, to_download, generate, download_workers),
+        run_stage(download_job, to_download, None, download),
+    )
+    return [describe, generate, download]
+
+def run_batch(client, directory, output_dir, describe_workers=4, generate_workers=2, download_workers=4, queue_size=8, force=False):
+    """Runs the pipeline over every image in `directory` and prints the per-stage metrics."""
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+    if not paths:
+        print(f"No images found in {directory}")
+        return
+    print(f"Processing {len(paths)} images...")
+
+    start = time.perf_counter()
+    stages = asyncio.run(run_pipeline(client, paths, output_dir, describe_workers,
+                                      generate_workers, download_workers, queue_size, force))
+    wall = time.perf_counter() - start
+
+    print(f"\n{'stage':<10}{'workers':>8}{'done':>6}{'failed':>7}{'busy s':>9}{'active s':>9}{'per min':>10}{'util':>7}")
+    for stats in stages:
+        print(stats.report())
+    serial = sum(stats.busy for stats in stages)
+    print(f"\nWall time {wall:.1f} s, serial time {serial:.1f} s ({serial / wall:.1f}x)")
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Generate an image from a description of an input image.")
     parser.add_argument("image_path", nargs='?', default=None, help="Path to the input image file.")
-    args = parser.parse_args()
+    parser.add_argument("--batch", metavar="DIR", help="Process every image in a directory as a pipeline")
+    parser.add_argument("--output_dir", help="Directory for the generated images (default: the current directory, DIR/generated in batch mode)")
+    parser.add_argument("--describe_workers", type=int, default=4, help="Concurrent image description requests")
+    parser.add_argument("--generate_workers", type=int, default=2, help="Concurrent image generation requests")
+    parser.add_argument("--download_workers", type=int, default=4, help="Concurrent downloads")
+    parser.add_argument("--queue_size", type=int, default=8, help="Jobs waiting between two stages before the earlier stage pauses")
+    parser.add_argument("--force", action="store_true", help="Generate new images even for descriptions generated before")
+    args = parser.parse_args(argv)
 
     image_path = args.image_path
-    if image_path is None:
+    if image_path is None and not args.batch:
         while True:
             image_path = input("Please enter the path to the image file: ")
             if os.path.exists(image_path):
                 break
             else:
                 print(f"Error: Image file not found at {image_path}")
-    
-    if not os.path.exists(image_path):
+
+    if not args.batch and not os.path.exists(image_path):
         print(f"Error: Image file not found at {image_path}")
         return
 
-    # Initialize OpenAI client
+    # Get the shared OpenAI client
     try:
-        client = OpenAI()
+        client = get_openai_client()
     except Exception as e:
         print(f"Error initializing OpenAI client: {e}")
         print("Please make sure your OPENAI_API_KEY environment variable is set correctly.")
         return
 
-    # Encode the image
-    try:
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode("utf-8")
-    except IOError as e:
-        print(f"Error reading image file: {e}")
+    if args.batch:
+        run_batch(client, args.batch, args.output_dir or os.path.join(args.batch, "generated"), args.describe_workers,
+                  args.generate_workers, args.download_workers, args.queue_size, args.force)
         return
 
     # Generate a description of the image
     print("Generating description for the image...")
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Describe this image in a detailed and creative way, suitable as a prompt for an image generation model."},
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
-                        },
-                    ],
-                }
-            ],
-            max_tokens=300,
-        )
-        description = response.choices[0].message.content
+        description = describe_image(client, image_path)
         print("Generated Description:")
         print(description)
+    except IOError as e:
+        print(f"Error reading image file: {e}")
+        return
     except Exception as e:
         print(f"Error generating description: {e}")
         return
 
+    images = ImageStore()
+    store = OutputStore(args.output_dir or ".")
+    reused = None if args.force else reuse_generated_image(store, images, image_path, description)
+    if reused:
+        print(f"\nAn image for the same description was generated before, saved as {reused}")
+        return
+
     # Generate an image from the description
     print("\nGenerating new image from the description...")
     try:
-        response = client.images.generate(
-            model="dall-e-3",
-            prompt=description,
-            size="1024x1024",
-            quality="standard",
-            n=1,
-        )
-        image_url = response.data[0].url
+        image_url = generate_image(client, description)
     except Exception as e:
         print(f"Error generating image: {e}")
         return
@@ -112,11 +276,11 @@ def main():
     print("Downloading and saving the new image...")
     image_data = fetch_url(image_url)
     if image_data:
-        input_filename = os.path.basename(image_path)
-        name, ext = os.path.splitext(input_filename)
-        output_filename = find_new_file_name(f"{name}_generated.png")
-        if save_binary_file(image_data, output_filename):
+        try:
+            output_filename = save_generated_image(store, images, image_data, image_path, description)
             print(f"New image saved as {output_filename}")
+        except OSError as e:
+            print(f"Error saving the new image: {e}")
 
 if __name__ == "__main__":
     main()
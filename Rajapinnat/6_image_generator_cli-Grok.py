@@ -1,17 +1,74 @@
 import argparse
 import os
-import requests
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llm_clients import OPENAI_BASE_URL, get_http_session, http_timeout
+from request_scheduler import call, set_rate
+from output_store import OutputStore
+from image_store import ImageStore, request_key
+from instrumentation import stage
 
 # Assuming you have the OpenAI API key set as an environment variable
 API_KEY = os.getenv('OPENAI_API_KEY')
-if not API_KEY:
-    print("Please set the OPENAI_API_KEY environment variable.")
-    exit(1)
 
-BASE_URL = "https://api.openai.com/v1/images/generations"
+BASE_URL = f"{OPENAI_BASE_URL}/images/generations"
 
-def generate_images(prompt, aspect_ratio, num_images):
+def download_image(session, image_url, image_cache, key, **metadata):
+    """
+    Streams the image in chunks into the image store so the whole file is
+    never held in memory. Returns the stored blob's path, or None on failure.
+    """
+    with stage("image_download") as span, \
+            call("download", session.get, image_url, stream=True, timeout=http_timeout()) as img_response:
+        if img_response.status_code != 200:
+            return None
+
+        # The nested "api.download" stage counts the bytes from Content-Length; count them here only without it
+        counted = (img_response.headers.get("Content-Length") or "").isdigit()
+
+        def chunks():
+            for chunk in img_response.iter_content(chunk_size=64 * 1024):
+                if not counted:
+                    span.add(bytes_received=len(chunk))
+                yield chunk
+        return image_cache.write(key, chunks(), **metadata)
+
+def generate_image(i, session, headers, body, store, image_cache, force=False):
+    """
+    Requests one image and downloads it as soon as its URL comes back. An
+    identical earlier request (same parameters and image number) is reused
+    from the image store unless `force` is set.
+    """
+    key = request_key(body["model"], body["prompt"], body["size"], body["quality"], body["style"], variant=i)
+    filename = None if force else image_cache.export(key, store, "generated_image.png", body["prompt"],
+                                                     size=body["size"], style=body["style"])
+    if filename:
+        print(f"Reused: {filename}")
+        return
+
+    # Rate limited and retried by the shared scheduler
+    response = call("openai:dall-e-3", session.post, BASE_URL, headers=headers, json=body, timeout=http_timeout())
+
+    if response.status_code != 200:
+        raise Exception(f"Non-200 response: {response.text}")
+
+    data = response.json()
+    images = data["data"]
+
+    for image in images:  # Should be only one
+        image_url = image["url"]
+        print(f"Image URL: {image_url}")
+        # Download into the image store and link it into the output directory (never overwrites earlier images)
+        blob = download_image(session, image_url, image_cache, key, prompt=body["prompt"],
+                              revised_prompt=image.get("revised_prompt"))
+        if blob:
+            filename = store.link(blob, "generated_image.png", body["prompt"], size=body["size"],
+                                  style=body["style"], revised_prompt=image.get("revised_prompt"))
+            print(f"Downloaded: {filename}")
+        else:
+            print(f"Failed to download image {i+1}")
+
+def generate_images(prompt, aspect_ratio, num_images, max_workers=4, requests_per_minute=None, output_dir=".", force=False):
     headers = {
         "Authorization": f"Bearer {API_KEY}",
         "Content-Type": "application/json",
@@ -35,47 +92,48 @@ def generate_images(prompt, aspect_ratio, num_images):
         "style": "vivid",  # Can add as parameter if desired
     }
 
-    for i in range(num_images):
-        response = requests.post(BASE_URL, headers=headers, json=body)
-
-        if response.status_code != 200:
-            raise Exception(f"Non-200 response: {response.text}")
-
-        data = response.json()
-        images = data["data"]
-
-        for image in images:  # Should be only one
-            image_url = image["url"]
-            print(f"Image URL: {image_url}")
-            # Download the image
-            img_response = requests.get(image_url)
-            if img_response.status_code == 200:
-                filename = f"generated_image_{i+1}.png"
-                with open(filename, "wb") as f:
-                    f.write(img_response.content)
-                print(f"Downloaded: {filename}")
-            else:
-                print(f"Failed to download image {i+1}")
-
-def interactive_mode():
+    session = get_http_session()
+    store = OutputStore(output_dir)
+    image_cache = ImageStore()
+    if requests_per_minute:
+        set_rate("openai:dall-e-3", requests_per_minute)
+
+    # Run the generation requests concurrently; each download starts as soon as its URL is known
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(generate_image, i, session, headers, body, store, image_cache, force) for i in range(num_images)]
+        for future in as_completed(futures):
+            future.result()
+
+def interactive_mode(max_workers=4, requests_per_minute=None, output_dir=".", force=False):
     prompt = input("Enter the prompt: ")
     aspect_ratio = input("Enter aspect ratio (1:1, 16:9, 4:3, 3:4): ")
     num_images = int(input("Enter number of images (1-10): "))
-    generate_images(prompt, aspect_ratio, num_images)
+    generate_images(prompt, aspect_ratio, num_images, max_workers, requests_per_minute, output_dir, force)
 
-if __name__ == "__main__":
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Generate images using OpenAI DALL-E-3.")
     parser.add_argument("--prompt", help="Image prompt")
     parser.add_argument("--aspect_ratio", help="Aspect ratio (1:1, 16:9, 4:3, 3:4)")
     parser.add_argument("--num_images", type=int, help="Number of images (1-10)")
+    parser.add_argument("--max_workers", type=int, default=4, help="Number of images generated concurrently")
+    parser.add_argument("--requests_per_minute", type=float, help="Limit for new generation requests per minute")
+    parser.add_argument("--output_dir", default=".", help="Directory for the images and their manifest.jsonl")
+    parser.add_argument("--force", action="store_true", help="Generate new images even if identical requests are stored")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    if not API_KEY:
+        print("Please set the OPENAI_API_KEY environment variable.")
+        exit(1)
 
     if not any([args.prompt, args.aspect_ratio, args.num_images]):
-        interactive_mode()
+        interactive_mode(args.max_workers, args.requests_per_minute, args.output_dir, args.force)
     else:
         # Use provided args, with defaults if missing
         prompt = args.prompt or input("Enter the prompt: ")
         aspect_ratio = args.aspect_ratio or input("Enter aspect ratio: ")
         num_images = args.num_images or int(input("Enter number of images: "))
-        generate_images(prompt, aspect_ratio, num_images)
\ No newline at end of file
+        generate_images(prompt, aspect_ratio, num_images, args.max_workers, args.requests_per_minute, args.output_dir, args.force)
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,48 @@
+import argparse
 import os
-import requests
 import json
-import tempfile
-import wave
-import pyaudio
-import playsound
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from llm_clients import OPENAI_BASE_URL, get_http_session, http_timeout
+from request_scheduler import call
 
 # Assuming you have the OpenAI API key set as an environment variable
 API_KEY = os.getenv('OPENAI_API_KEY')
-if not API_KEY:
-    print("Please set the OPENAI_API_KEY environment variable.")
-    exit(1)
 
-def record_audio(filename, duration=5):
-    chunk = 1024
-    format = pyaudio.paInt16
-    channels = 1
-    rate = 44100
+def record_audio(duration=5):
+    """
+    Records from the microphone into memory for at most `duration` seconds and
+    returns the recording (a WavBuffer). Recording stops early once the speaker
+    goes quiet, and silence at both ends is trimmed.
+    """
+    import audio_utils  # needs numpy, imported when audio is handled
 
-    p = pyaudio.PyAudio()
-    stream = p.open(format=format, channels=channels, rate=rate, input=True, frames_per_buffer=chunk)
+    recording = audio_utils.record_until_silence(
+        duration, on_ready=lambda: print("Recording... (stops when you stop speaking)"))
+    print("Recording finished.")
+    return recording
 
-    print("Recording...")
-    frames = []
-    for i in range(0, int(rate / chunk * duration)):
-        data = stream.read(chunk)
-        frames.append(data)
+def transcribe_audio(recording):
+    import audio_utils
 
-    print("Recording finished.")
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
-
-    wf = wave.open(filename, 'wb')
-    wf.setnchannels(channels)
-    wf.setsampwidth(p.get_sample_size(format))
-    wf.setframerate(rate)
-    wf.writeframes(b''.join(frames))
-    wf.close()
-
-def transcribe_audio(filename):
-    url = "https://api.openai.com/v1/audio/transcriptions"
+    url = f"{OPENAI_BASE_URL}/audio/transcriptions"
     headers = {
         "Authorization": f"Bearer {API_KEY}",
     }
+    # Downsampled to 16 kHz, compressed and uploaded straight from memory
     files = {
-        "file": open(filename, "rb"),
+        "file": audio_utils.encode_audio(recording.pcm(), recording.rate),
         "model": (None, "whisper-1"),
     }
-    response = requests.post(url, headers=headers, files=files)
+    response = call("openai:whisper-1", get_http_session().post, url, headers=headers, files=files, timeout=http_timeout())
     if response.status_code != 200:
         raise Exception(f"Transcription failed: {response.text}")
     return response.json()["text"]
 
 def translate_text(text, source_lang, target_lang):
-    url = "https://api.openai.com/v1/chat/completions"
+    url = f"{OPENAI_BASE_URL}/chat/completions"
     headers = {
         "Authorization": f"Bearer {API_KEY}",
         "Content-Type": "application/json",
@@ -65,13 +53,18 @@ def translate_text(text, source_lang, target_lang):
         "messages": [{"role": "user", "content": prompt}],
         "max_tokens": 1000,
     }
-    response = requests.post(url, headers=headers, json=data)
+    response = call("openai:gpt-3.5-turbo", get_http_session().post, url, headers=headers, json=data, timeout=http_timeout())
     if response.status_code != 200:
         raise Exception(f"Translation failed: {response.text}")
     return response.json()["choices"][0]["message"]["content"].strip()
 
-def text_to_speech(text, filename):
-    url = "https://api.openai.com/v1/audio/speech"
+def text_to_speech(text):
+    """
+    Requests the spoken text as 24 kHz 16-bit mono PCM and returns an iterator
+    over the audio chunks as they arrive, so playback can start before the
+    whole response has been downloaded.
+    """
+    url = f"{OPENAI_BASE_URL}/audio/speech"
     headers = {
         "Authorization": f"Bearer {API_KEY}",
         "Content-Type": "application/json",
@@ -80,37 +73,119 @@ def text_to_speech(text, filename):
         "model": "tts-1",
         "input": text,
         "voice": "alloy",  # Can change to other voices like echo, fable, onyx, nova, shimmer
+        "response_format": "pcm",  # raw samples that can be played from memory
     }
-    response = requests.post(url, headers=headers, json=data)
+    response = call("openai:tts-1", get_http_session().post, url, headers=headers, json=data,
+                    stream=True, timeout=http_timeout())
     if response.status_code != 200:
         raise Exception(f"TTS failed: {response.text}")
-    with open(filename, "wb") as f:
-        f.write(response.content)
+    return response.iter_content(chunk_size=4096)
+
+def process_segment(segment, source_lang, target_lang):
+    """Transcribes, translates and speaks one speech segment. Returns (text, translation, speech chunks)."""
+    transcribed_text = transcribe_audio(segment)
+    if not transcribed_text.strip():
+        return transcribed_text, "", None
+
+    translated_text = translate_text(transcribed_text, source_lang, target_lang)
+    return transcribed_text, translated_text, text_to_speech(translated_text)
+
+def streaming_mode(source_lang, target_lang, workers=3):
+    """
+    Listens continuously and splits the audio into speech segments. Each segment
+    is transcribed, translated and spoken while the next one is being recorded,
+    and the translations are played back in the order they were spoken.
+    The microphone is ignored while a translation plays, so that it is not
+    picked up from the speakers and translated again.
+    """
+    import audio_utils
+
+    stop = threading.Event()
+    playing = threading.Event()
+    pending = queue.Queue()
+
+    def record():
+        try:
+            frames = audio_utils.microphone_frames(stop)
+            threshold = audio_utils.calibrate_threshold(frames)
+            print("Listening... (press Ctrl+C to stop)")
+            heard = (data for data in frames if not playing.is_set())
+            for segment in audio_utils.speech_segments(heard, threshold):
+                pending.put(executor.submit(process_segment, segment, source_lang, target_lang))
+        finally:
+            pending.put(None)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, audio_utils.Speaker() as speaker:
+        recorder = threading.Thread(target=record, daemon=True)
+        recorder.start()
+        try:
+            while True:
+                future = pending.get()
+                if future is None:
+                    break
+                try:
+                    transcribed_text, translated_text, speech = future.result()
+                except Exception as e:
+                    print(f"Error: {e}")
+                    continue
+                if speech is None:
+                    continue
+                print(f"Transcribed: {transcribed_text}")
+                print(f"Translated: {translated_text}")
+                playing.set()
+                try:
+                    speaker.play(speech)
+                    time.sleep(speaker.latency())  # the end of the translation is still in the device buffer
+                finally:
+                    playing.clear()
+        except KeyboardInterrupt:
+            print("\nStopping...")
+        finally:
+            stop.set()
+            recorder.join()
+            # Drop the segments that were not processed yet
+            while True:
+                try:
+                    future = pending.get_nowait()
+                except queue.Empty:
+                    break
+                if future is None:
+                    break
+                future.cancel()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Speech to speech interpreter using OpenAI.")
+    parser.add_argument("-s", "--stream", action="store_true",
+                        help="Translate continuously, one spoken segment at a time "
+                             "(the microphone is muted while a translation plays)")
+    args = parser.parse_args(argv)
+
+    if not API_KEY:
+        print("Please set the OPENAI_API_KEY environment variable.")
+        exit(1)
 
-def main():
     source_lang = input("Enter source language (e.g., English): ")
     target_lang = input("Enter target language (e.g., French): ")
-    duration = int(input("Enter recording duration in seconds: "))
 
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio:
-        audio_file = temp_audio.name
+    if args.stream:
+        streaming_mode(source_lang, target_lang)
+        return
+
+    duration = int(input("Enter maximum recording duration in seconds: "))
 
-    record_audio(audio_file, duration)
-    transcribed_text = transcribe_audio(audio_file)
+    recording = record_audio(duration)
+    if recording.length == 0:
+        print("No speech detected.")
+        return
+    transcribed_text = transcribe_audio(recording)
     print(f"Transcribed: {transcribed_text}")
 
     translated_text = translate_text(transcribed_text, source_lang, target_lang)
     print(f"Translated: {translated_text}")
 
-    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_speech:
-        speech_file = temp_speech.name
-
-    text_to_speech(translated_text, speech_file)
-    playsound.playsound(speech_file)
+    import audio_utils
 
-    # Clean up temp files
-    os.unlink(audio_file)
-    os.unlink(speech_file)
+    audio_utils.play_pcm(text_to_speech(translated_text))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,54 +1,38 @@
-import pyaudio
-import wave
-import openai
-import os
+import argparse
 import requests
+import audio_utils
+from llm_clients import get_openai_client, get_http_session, http_timeout
+from request_scheduler import call
+from output_store import OutputStore
+from image_store import ImageStore, request_key
+from instrumentation import stage
 
-# Set up OpenAI client
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-def record_audio(filename, duration=10):
-    chunk = 1024
-    format = pyaudio.paInt16
-    channels = 1
-    rate = 44100
-
-    p = pyaudio.PyAudio()
-    stream = p.open(format=format,
-                    channels=channels,
-                    rate=rate,
-                    input=True,
-                    frames_per_buffer=chunk)
-
-    print("Recording... Speak your image prompt.")
-    frames = []
-
-    for i in range(0, int(rate / chunk * duration)):
-        data = stream.read(chunk)
-        frames.append(data)
-
+def record_audio(duration=10):
+    """
+    Records from the microphone into memory for at most `duration` seconds and
+    returns the recording (a WavBuffer). Recording stops early once the speaker
+    goes quiet, and silence at both ends is trimmed.
+    """
+    recording = audio_utils.record_until_silence(
+        duration, on_ready=lambda: print("Recording... Speak your image prompt."))
     print("Finished recording.")
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
-
-    wf = wave.open(filename, 'wb')
-    wf.setnchannels(channels)
-    wf.setsampwidth(p.get_sample_size(format))
-    wf.setframerate(rate)
-    wf.writeframes(b''.join(frames))
-    wf.close()
+    return recording
 
-def transcribe_audio(filename):
-    with open(filename, "rb") as audio_file:
-        transcript = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file
-        )
+def transcribe_audio(recording):
+    # Downsampled to 16 kHz and compressed before upload; the SDK needs bytes
+    name, data, mime = audio_utils.encode_audio(recording.pcm(), recording.rate)
+    transcript = call(
+        "openai:whisper-1",
+        get_openai_client().audio.transcriptions.create,
+        model="whisper-1",
+        file=(name, bytes(data), mime),
+    )
     return transcript.text
 
 def generate_image(prompt):
-    response = client.images.generate(
+    response = call(
+        "openai:dall-e-3",
+        get_openai_client().images.generate,
         model="dall-e-3",
         prompt=prompt,
         size="1024x1024",
@@ -58,21 +42,42 @@ def generate_image(prompt):
     image_url = response.data[0].url
     return image_url
 
-if __name__ == "__main__":
-    audio_file = "temp_audio.wav"
-    record_audio(audio_file, duration=10)
-    prompt = transcribe_audio(audio_file)
+def image_key(prompt):
+    """Image store key of the generate_image() request for `prompt`."""
+    return request_key("dall-e-3", prompt, "1024x1024", "standard")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate an image from a spoken prompt with DALL-E 3.")
+    parser.add_argument("--force", action="store_true", help="Generate a new image even if the same prompt was used before")
+    args = parser.parse_args(argv)
+
+    recording = record_audio(duration=10)
+    prompt = transcribe_audio(recording) if recording.length else ""
     print(f"Transcribed prompt: {prompt}")
-    if prompt.strip():
-        image_url = generate_image(prompt)
-        print(f"Image generated: {image_url}")
-        # Download and save the image
-        response = requests.get(image_url)
-        with open("generated_image.png", "wb") as f:
-            f.write(response.content)
-        print("Image saved as generated_image.png")
-    else:
+    if not prompt.strip():
         print("No speech detected.")
-    # Clean up
-    if os.path.exists(audio_file):
-        os.remove(audio_file)
\ No newline at end of file
+        return
+
+    images = ImageStore()
+    store = OutputStore()
+    filename = None if args.force else images.export(image_key(prompt), store, "generated_image.png", prompt)
+    if filename:
+        print(f"Image for the same prompt reused as {filename}")
+        return
+
+    image_url = generate_image(prompt)
+    print(f"Image generated: {image_url}")
+    # Download into the image store and link it into place without overwriting earlier images
+    try:
+        with stage("image_download"):  # the bytes are counted by the nested "api.download" stage
+            response = call("download", get_http_session().get, image_url, timeout=http_timeout())
+            response.raise_for_status()  # an error page must not be stored as the image
+    except requests.exceptions.RequestException as e:
+        print(f"Error downloading image: {e}")
+        return
+    blob = images.put(image_key(prompt), response.content, prompt=prompt)
+    filename = store.link(blob, "generated_image.png", prompt=prompt)
+    print(f"Image saved as {filename}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
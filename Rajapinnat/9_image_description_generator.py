@@ -1,23 +1,184 @@
-from google import genai
-from google.genai import types
 import argparse
+import json
 import os
-import mimetypes
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llm_clients import get_gemini_client
+from request_scheduler import call
+from image_preprocessing import prepare_image, GEMINI_VISION
 
-def main():
+MODEL = "gemini-2.5-flash"
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".heic", ".heif"}
+
+BATCH_PROMPT = ("Analyze these product images. Each image is preceded by its label (image 1, image 2, ...). "
+                "For every image, generate a detailed product description and creative marketing slogans. "
+                "Output only a valid JSON array with one object per image, with the keys: "
+                "image (the label exactly as given), description (string), slogans (array of strings).")
+
+def load_image_part(img_path):
+    """Reads an image file into a Gemini inline data part, downscaled and re-encoded as JPEG."""
+    from google.genai import types  # slow to import, only needed once a request is built
+
+    image_data, mime_type = prepare_image(img_path, **GEMINI_VISION)
+    return types.Part(
+        inline_data=types.Blob(
+            mime_type=mime_type,
+            data=image_data
+        )
+    )
+
+def list_batch_images(directory=None, manifest=None):
+    """Image paths from a directory (recursively) or from a manifest file with one path per line."""
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, encoding="utf-8") as f:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        return [path if os.path.isabs(path) else os.path.join(base, path) for path in paths]
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+def group_by_bytes(paths, max_bytes, max_images):
+    """
+    Groups image paths into requests whose total file size stays under `max_bytes`.
+    Returns (groups, unreadable) where unreadable lists (path, error) for files that could not be read.
+    """
+    groups, unreadable, current, current_bytes = [], [], [], 0
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            unreadable.append((path, e))
+            continue
+        if current and (current_bytes + size > max_bytes or len(current) >= max_images):
+            groups.append(current)
+            current, current_bytes = [], 0
+        current.append(path)
+        current_bytes += size
+    if current:
+        groups.append(current)
+    return groups, unreadable
+
+def parse_group_response(text, count):
+    """Parses the JSON array answer for a group of `count` images and returns {index: entry}."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find("\n") + 1:] if "\n" in text else text
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = next((value for value in data.values() if isinstance(value, list)), [])
+
+    entries = {}
+    for i, entry in enumerate(data):
+        if not isinstance(entry, dict):
+            continue
+        match = re.search(r"\d+", str(entry.get("image", "")))
+        if match and 1 <= int(match.group()) <= count:
+            entries[int(match.group()) - 1] = entry
+        elif len(data) == count:
+            entries[i] = entry  # label missing or changed: same order as sent
+    return entries
+
+def describe_group(client, paths, user_text):
+    """
+    Sends one request for a group of images and returns one record per image.
+    The images are labelled by number, so no local paths are sent to the API.
+    """
+    prompt = BATCH_PROMPT
+    if user_text:
+        prompt += f" Additional context: {user_text}"
+    from google.genai import types
+
+    contents = [types.Part(text=prompt)]
+    for i, path in enumerate(paths):
+        contents.append(types.Part(text=f"Image label: image {i + 1}"))
+        contents.append(load_image_part(path))
+
+    response = call(
+        f"gemini:{MODEL}",
+        client.models.generate_content,
+        model=MODEL,
+        contents=contents,
+        config=types.GenerateContentConfig(response_mime_type="application/json"),
+    )
+    entries = parse_group_response(response.text or "", len(paths))
+    records = []
+    for i, path in enumerate(paths):
+        entry = entries.get(i)
+        if entry is None:
+            records.append({"image": path, "error": "missing from response"})
+        else:
+            records.append({"image": path, "description": entry.get("description"), "slogans": entry.get("slogans", [])})
+    return records
+
+def completed_images(output):
+    """Images that already have a successful record in the output file (for resuming)."""
+    done = set()
+    if os.path.exists(output):
+        with open(output, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by an interrupted run
+                if "error" not in record:
+                    done.add(record.get("image"))
+    return done
+
+def run_batch(client, paths, output, user_text, max_bytes, max_images, workers):
+    """Describes many images with bounded concurrent requests and appends the results to a JSON Lines file."""
+    done = completed_images(output)
+    todo = [path for path in paths if path not in done]
+    groups, unreadable = group_by_bytes(todo, max_bytes, max_images)
+    print(f"{len(paths)} images, {len(done)} already done, {len(todo)} to process in {len(groups)} requests")
+
+    written = 0
+    with open(output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as executor:
+        # Missing or unreadable files get an error record (and are retried by the next run) instead of stopping the batch
+        for path, error in unreadable:
+            out.write(json.dumps({"image": path, "error": str(error)}, ensure_ascii=False) + "\n")
+            written += 1
+        futures = {executor.submit(describe_group, client, group, user_text): group for group in groups}
+        for future in as_completed(futures):
+            try:
+                records = future.result()
+            except Exception as e:
+                records = [{"image": path, "error": str(e)} for path in futures[future]]
+            for record in records:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            written += len(records)
+            print(f"Processed {written}/{len(todo)} images")
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Generate product descriptions and marketing slogans from images using Gemini AI.")
     parser.add_argument('--images', nargs='+', help='Paths to image files (space-separated)')
     parser.add_argument('--user_text', help='User input text for better accuracy')
     parser.add_argument('--api_key', help='Google API key (or set GEMINI_API_KEY env var)')
+    parser.add_argument('--dir', help='Batch mode: describe every image in this directory')
+    parser.add_argument('--manifest', help='Batch mode: file with one image path per line')
+    parser.add_argument('--output', default='descriptions.jsonl', help='JSON Lines output file for batch mode (resumed if it exists)')
+    parser.add_argument('--max_batch_bytes', type=int, default=15 * 1024 * 1024, help='Maximum total image size per request')
+    parser.add_argument('--max_batch_images', type=int, default=16, help='Maximum number of images per request')
+    parser.add_argument('--workers', type=int, default=4, help='Number of requests sent concurrently')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Get API key
     api_key = args.api_key or os.getenv("GEMINI_API_KEY")
     if not api_key:
         api_key = input("Enter your Google API key: ").strip()
     os.environ["GEMINI_API_KEY"] = api_key
-    client = genai.Client()
+    client = get_gemini_client()
+
+    if args.dir or args.manifest:
+        run_batch(client, list_batch_images(args.dir, args.manifest), args.output, args.user_text,
+                  args.max_batch_bytes, args.max_batch_images, max(1, args.workers))
+        return
 
     # Get images
     images = args.images
@@ -36,18 +197,7 @@ def main():
             print(f"Image file not found: {img_path}")
             continue
         try:
-            mime_type, _ = mimetypes.guess_type(img_path)
-            if not mime_type:
-                mime_type = "image/jpeg"  # default
-            with open(img_path, "rb") as f:
-                image_data = f.read()
-            image_part = types.Part(
-                inline_data=types.Blob(
-                    mime_type=mime_type,
-                    data=image_data
-                )
-            )
-            image_parts.append(image_part)
+            image_parts.append(load_image_part(img_path))
         except Exception as e:
             print(f"Error loading image {img_path}: {e}")
 
@@ -67,11 +217,13 @@ def main():
     prompt += " Generate detailed product descriptions and creative marketing slogans for each product visible in the images. Structure the output with clear headings for each product."
 
     # Prepare contents
+    from google.genai import types
+
     contents = [types.Part(text=prompt)] + image_parts
 
     # Generate content
     try:
-        response = client.models.generate_content(model="gemini-2.5-flash", contents=contents)
+        response = call(f"gemini:{MODEL}", client.models.generate_content, model=MODEL, contents=contents)
         print("\nGenerated Content:\n")
         print(response.text)
     except Exception as e:
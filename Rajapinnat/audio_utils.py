@@ -0,0 +1,369 @@
+"""
+Microphone capture, speech segmentation and playback shared by the voice scripts.
+
+Audio is 16-bit mono PCM and never touches the disk: samples are recorded
+straight into a preallocated buffer that leaves room for a WAV header, so the
+finished recording can be uploaded as a WAV file without copying it again.
+
+Before upload, recordings are downsampled to 16 kHz (all that speech
+recognition needs) and optionally compressed to FLAC or Opus when the
+`soundfile` package is installed (AUDIO_UPLOAD_FORMAT=wav|flac|opus).
+
+Voice activity is detected per frame from its energy and zero-crossing
+rate. Recordings stop after a stretch of trailing silence, and leading and
+trailing silence is cut off before upload.
+"""
+
+import io
+import itertools
+import os
+import struct
+
+import numpy as np
+
+from instrumentation import stage
+
+CHUNK = 1024
+CHANNELS = 1
+RATE = 44100
+SAMPLE_WIDTH = 2
+WAV_HEADER_SIZE = 44
+TTS_RATE = 24000  # OpenAI TTS "pcm" output: 24 kHz 16-bit mono
+
+UPLOAD_RATE = 16000
+UPLOAD_FORMAT = os.getenv("AUDIO_UPLOAD_FORMAT", "flac")
+UPLOAD_FORMATS = {
+    # format: (file name, MIME type, soundfile format, soundfile subtype)
+    "wav": ("speech.wav", "audio/wav", None, None),
+    "flac": ("speech.flac", "audio/flac", "FLAC", "PCM_16"),
+    "opus": ("speech.ogg", "audio/ogg", "OGG", "OPUS"),
+}
+
+
+SILENCE_SECONDS = 1.5  # trailing silence that ends a recording
+TAIL_SECONDS = 0.2  # silence kept after the last word
+PRE_ROLL_SECONDS = 0.2  # audio kept before the first word
+CALIBRATION_SECONDS = 0.3  # background noise measured before a recording
+MAX_THRESHOLD = 2000.0  # above quiet speech; a higher threshold means the calibration heard speech
+
+
+def frame_rms(data):
+    """Root mean square level of a frame of 16-bit samples."""
+    samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+    return float(np.sqrt(np.mean(samples * samples))) if samples.size else 0.0
+
+
+def zero_crossing_rate(data):
+    """Fraction of neighbouring samples in a frame whose sign differs."""
+    samples = np.frombuffer(data, dtype=np.int16)
+    if samples.size < 2:
+        return 0.0
+    return float(np.count_nonzero(np.signbit(samples[1:]) != np.signbit(samples[:-1]))) / (samples.size - 1)
+
+
+def is_speech(data, threshold):
+    """
+    Energy/zero-crossing voice activity decision for one frame. Voiced sounds
+    are loud; unvoiced consonants such as 's' or 'f' are quieter but cross zero
+    often, so they count as speech at half the energy threshold.
+    """
+    rms = frame_rms(data)
+    if rms > threshold:
+        return True
+    return rms > threshold / 2 and zero_crossing_rate(data) > 0.25
+
+
+class WavBuffer:
+    """PCM samples written into a preallocated buffer behind space for a WAV header."""
+
+    def __init__(self, max_bytes, rate=RATE):
+        self.rate = rate
+        self.buffer = bytearray(WAV_HEADER_SIZE + max_bytes)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+
+    @property
+    def capacity(self):
+        return len(self.buffer) - WAV_HEADER_SIZE
+
+    def append(self, data):
+        """Copies `data` into the buffer; anything beyond the capacity is dropped."""
+        n = min(len(data), self.capacity - self.length)
+        start = WAV_HEADER_SIZE + self.length
+        self.view[start:start + n] = memoryview(data)[:n]
+        self.length += n
+
+    def pcm(self):
+        return self.view[WAV_HEADER_SIZE:WAV_HEADER_SIZE + self.length]
+
+    def wav(self):
+        """Fills in the header and returns the WAV file as a memoryview (no copy)."""
+        byte_rate = self.rate * CHANNELS * SAMPLE_WIDTH
+        struct.pack_into("<4sI4s4sIHHIIHH4sI", self.buffer, 0,
+                         b"RIFF", 36 + self.length, b"WAVE", b"fmt ", 16, 1, CHANNELS,
+                         self.rate, byte_rate, CHANNELS * SAMPLE_WIDTH, SAMPLE_WIDTH * 8,
+                         b"data", self.length)
+        return self.view[:WAV_HEADER_SIZE + self.length]
+
+
+class RingBuffer:
+    """Fixed size ring of the most recent audio bytes."""
+
+    def __init__(self, size):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.length = 0
+
+    def write(self, data):
+        data = memoryview(data)[-len(self.buffer):]
+        end = (self.start + self.length) % len(self.buffer)
+        first = min(len(data), len(self.buffer) - end)
+        self.view[end:end + first] = data[:first]
+        self.view[:len(data) - first] = data[first:]
+        overflow = max(0, self.length + len(data) - len(self.buffer))
+        self.start = (self.start + overflow) % len(self.buffer)
+        self.length = min(len(self.buffer), self.length + len(data))
+
+    def drain_into(self, target):
+        """Appends the buffered bytes to `target` (a WavBuffer) in order and empties the ring."""
+        first = min(self.length, len(self.buffer) - self.start)
+        target.append(self.view[self.start:self.start + first])
+        target.append(self.view[:self.length - first])
+        self.start = self.length = 0
+
+
+def resample(samples, src_rate, dst_rate, taps=63):
+    """
+    Resamples int16 samples with NumPy only: a windowed-sinc low-pass filter
+    against aliasing followed by linear interpolation at the new sample times.
+    """
+    if src_rate == dst_rate or samples.size == 0:
+        return samples
+    x = samples.astype(np.float32)
+    if dst_rate < src_rate:
+        cutoff = 0.45 * dst_rate / src_rate  # a bit below the new Nyquist frequency, in cycles per sample
+        n = np.arange(taps) - (taps - 1) / 2
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+        x = np.convolve(x, (kernel / kernel.sum()).astype(np.float32), mode="same")
+    positions = np.arange(int(len(x) * dst_rate / src_rate)) * (src_rate / dst_rate)
+    y = np.interp(positions, np.arange(len(x)), x)
+    return np.clip(np.round(y), -32768, 32767).astype(np.int16)
+
+
+def encode_audio(pcm, rate=RATE, fmt=UPLOAD_FORMAT, target_rate=UPLOAD_RATE):
+    """
+    Downsamples 16-bit mono PCM to `target_rate` and encodes it as `fmt`.
+    Returns a (file name, data, MIME type) tuple ready for a multipart upload.
+    Falls back to WAV when the `soundfile` package or the codec is not available.
+    """
+    with stage("audio_encode", format=fmt, rate=target_rate) as span:
+        name, data, mime = _encode(pcm, rate, fmt, target_rate)
+        span.add(bytes_in=len(pcm), bytes_out=len(data))
+        return name, data, mime
+
+
+def _encode(pcm, rate, fmt, target_rate):
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    if target_rate and target_rate < rate:
+        samples = resample(samples, rate, target_rate)
+        rate = target_rate
+
+    name, mime, sf_format, sf_subtype = UPLOAD_FORMATS.get(fmt, UPLOAD_FORMATS["wav"])
+    if sf_format:
+        try:
+            import soundfile
+            buffer = io.BytesIO()
+            soundfile.write(buffer, samples, rate, format=sf_format, subtype=sf_subtype)
+            return name, buffer.getvalue(), mime
+        except Exception:
+            name, mime, _, _ = UPLOAD_FORMATS["wav"]
+
+    wav = WavBuffer(samples.nbytes, rate)
+    wav.append(samples.view(np.uint8))
+    return name, wav.wav(), mime
+
+
+def microphone_frames(stop_event=None, max_frames=None):
+    """Yields CHUNK sized frames from the default microphone until `stop_event` is set or `max_frames` are read."""
+    import pyaudio  # only needed when audio hardware is used
+
+    p = pyaudio.PyAudio()
+    stream = p.open(format=pyaudio.paInt16, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
+    try:
+        count = 0
+        while not (stop_event is not None and stop_event.is_set()) and (max_frames is None or count < max_frames):
+            yield stream.read(CHUNK, exception_on_overflow=False)
+            count += 1
+    finally:
+        stream.stop_stream()
+        stream.close()
+        p.terminate()
+
+
+class Speaker:
+    """
+    Output stream that is opened once and reused for many playbacks, because
+    initialising the audio device takes long enough to be heard.
+    """
+
+    def __init__(self, rate=TTS_RATE):
+        import pyaudio  # only needed when audio hardware is used
+
+        self._pyaudio = pyaudio.PyAudio()
+        self._stream = self._pyaudio.open(format=pyaudio.paInt16, channels=CHANNELS, rate=rate, output=True)
+
+    def play(self, pcm):
+        """
+        Plays 16-bit mono PCM given as bytes or as an iterable of byte chunks.
+        Chunks are played as they arrive, so a streamed response starts playing
+        before it has been downloaded completely. Returns when the last chunk
+        has been handed to the device, about latency() before it has been heard.
+        """
+        chunks = [pcm] if isinstance(pcm, (bytes, bytearray, memoryview)) else pcm
+        rest = b""
+        for chunk in chunks:
+            data = rest + bytes(chunk)
+            whole = len(data) - len(data) % SAMPLE_WIDTH  # a chunk may end in the middle of a sample
+            self._stream.write(data[:whole])
+            rest = data[whole:]
+
+    def latency(self):
+        """Seconds of audio still buffered in the device after play() returns."""
+        return self._stream.get_output_latency()
+
+    def close(self):
+        self._stream.stop_stream()  # waits until the buffered audio has been played
+        self._stream.close()
+        self._pyaudio.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def play_pcm(pcm, rate=TTS_RATE):
+    """Plays 16-bit mono PCM (bytes or an iterable of byte chunks) once; see Speaker for repeated playback."""
+    with Speaker(rate) as speaker:
+        speaker.play(pcm)
+
+
+def calibrate_threshold(frames, seconds=0.5, factor=3.0, minimum=300.0):
+    """
+    Measures the background noise from the first `seconds` of audio and returns
+    a speech threshold. The noise level is a low percentile of the frame levels,
+    so words spoken during the measurement do not raise it.
+    """
+    levels = [frame_rms(data) for _, data in zip(range(max(1, int(seconds * RATE / CHUNK))), frames)]
+    if not levels:
+        return minimum
+    return min(MAX_THRESHOLD, max(minimum, factor * float(np.percentile(levels, 10))))
+
+
+def record_until_silence(max_duration, silence_seconds=SILENCE_SECONDS, threshold=None, stop_event=None, on_ready=None):
+    """
+    Records from the microphone until the speaker has been quiet for
+    `silence_seconds` or `max_duration` has passed. Leading silence is never
+    stored (apart from a short pre-roll) and trailing silence is cut off, so the
+    returned WavBuffer only contains the speech. It is empty if nobody spoke.
+    `on_ready` is called once the background noise has been measured, which is
+    the moment to tell the speaker to start.
+    """
+    with stage("audio_capture") as span:
+        recording = _record(max_duration, silence_seconds, threshold, stop_event, on_ready)
+        span.add(bytes_out=recording.length)
+        return recording
+
+
+def _record(max_duration, silence_seconds, threshold, stop_event, on_ready):
+    frame_seconds = CHUNK / RATE
+    frame_bytes = CHUNK * SAMPLE_WIDTH
+    max_frames = int(max_duration / frame_seconds)
+    silence_frames = max(1, int(silence_seconds / frame_seconds))
+    pre_roll = RingBuffer(max(1, int(PRE_ROLL_SECONDS / frame_seconds)) * frame_bytes)
+    tail_bytes = int(TAIL_SECONDS / frame_seconds) * frame_bytes
+
+    microphone = microphone_frames(stop_event, max_frames=max_frames)
+    frames = microphone
+    if threshold is None:
+        calibration = [data for _, data in zip(range(max(1, int(CALIBRATION_SECONDS / frame_seconds))), microphone)]
+        threshold = calibrate_threshold(calibration, seconds=CALIBRATION_SECONDS)
+        # The calibration frames go through the voice detection too, in case the speaker did not wait
+        frames = itertools.chain(calibration, microphone)
+    if on_ready is not None:
+        on_ready()
+    recording = WavBuffer(max_frames * frame_bytes + len(pre_roll.buffer))
+
+    started = False
+    silent = speech_end = 0
+    for data in frames:
+        speech = is_speech(data, threshold)
+        if not started:
+            if not speech:
+                pre_roll.write(data)
+                continue
+            started = True
+            pre_roll.drain_into(recording)
+        recording.append(data)
+        if speech:
+            silent = 0
+            speech_end = recording.length
+        else:
+            silent += 1
+            if silent >= silence_frames:
+                break
+    microphone.close()  # stops and closes the microphone stream
+
+    recording.length = min(recording.length, speech_end + tail_bytes)
+    return recording
+
+
+def speech_segments(frames, threshold, silence_seconds=0.6, min_speech_seconds=0.3,
+                    max_segment_seconds=15.0, pre_roll_seconds=PRE_ROLL_SECONDS):
+    """
+    Splits a stream of frames into speech segments and yields each segment as
+    a WavBuffer as soon as it has ended, with its trailing silence trimmed.
+    A short pre-roll ring keeps the start of the first word, and long
+    monologues are cut every `max_segment_seconds`.
+    """
+    frame_seconds = CHUNK / RATE
+    frame_bytes = CHUNK * SAMPLE_WIDTH
+    silence_frames = max(1, int(silence_seconds / frame_seconds))
+    min_speech_frames = max(1, int(min_speech_seconds / frame_seconds))
+    max_frames = max(1, int(max_segment_seconds / frame_seconds))
+    pre_roll_frames = max(1, int(pre_roll_seconds / frame_seconds))
+    pre_roll = RingBuffer(pre_roll_frames * frame_bytes)
+    tail_frames = int(TAIL_SECONDS / frame_seconds)
+
+    segment = None
+    voiced = silent = frames_in_segment = 0
+    for data in frames:
+        loud = is_speech(data, threshold)
+        if segment is None:
+            if loud:
+                # Each segment gets its own buffer because it is still in use while the next one records
+                segment = WavBuffer((pre_roll_frames + max_frames) * frame_bytes)
+                pre_roll.drain_into(segment)
+                segment.append(data)
+                voiced, silent, frames_in_segment = 1, 0, 1
+            else:
+                pre_roll.write(data)
+            continue
+
+        segment.append(data)
+        frames_in_segment += 1
+        if loud:
+            voiced += 1
+            silent = 0
+        else:
+            silent += 1
+        if silent >= silence_frames or frames_in_segment >= max_frames:
+            if voiced >= min_speech_frames:
+                segment.length -= max(0, silent - tail_frames) * frame_bytes
+                yield segment
+            segment = None
+
+    if segment is not None and voiced >= min_speech_frames:
+        yield segment
@@ -0,0 +1,257 @@
+"""
+Offline benchmark of the Rajapinnat scripts against the local mock provider.
+
+Starts mock_provider.py in this process (or uses one given with --url),
+points the API clients at it and drives the scripts' own functions at the
+given concurrency levels:
+    creative     3_creative_writer – OpenAI.py generate_creative_content()
+    stream       the same, streamed token by token
+    summarize    4_llm_cli_utility.main() on a generated document (map-reduce)
+    imagegen     6_image_generator_cli-Grok.py generate_images()
+    interpreter  7_interpreter.py process_segment() on a synthetic speech segment
+    dictionary   10_dictionary_app.py lookup_word() without the cache
+
+For every scenario and concurrency level the p50/p95/p99 latency and the
+throughput are reported. Results can be saved with --json and compared with
+an earlier run with --baseline; the exit status is 1 when a scenario got
+slower than --tolerance allows.
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mock_provider
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def configure_environment(url, workdir):
+    """Points every client at the mock server. Must run before the scripts are imported."""
+    os.environ.update({
+        "OPENAI_BASE_URL": f"{url}/v1",
+        "OPENROUTER_BASE_URL": f"{url}/v1",
+        "GEMINI_BASE_URL": url,
+        "OPENAI_API_KEY": "mock",
+        "OPENROUTER_API_KEY": "mock",
+        "GEMINI_API_KEY": "mock",
+        "RAJAPINNAT_CACHE_DIR": os.path.join(workdir, "cache"),
+        # Measure the scripts, not the client-side rate limits
+        "RATE_LIMITS": "openai=1000000,openrouter=1000000,gemini=1000000,download=1000000",
+    })
+
+
+def load_script(filename):
+    """Imports one of the numbered scripts (their file names are not valid module names)."""
+    name = "bench_" + re.sub(r"\W", "_", os.path.splitext(filename)[0])
+    spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def creative_scenario(workdir, stream=False):
+    module = load_script("3_creative_writer – OpenAI.py")
+
+    def run(i):
+        out = io.StringIO() if stream else None
+        text = module.generate_creative_content(f"A product story number {i}", "gpt-4o-mini", 0.7, 1.0, 0.0, 0.0, out)
+        if text.startswith("An error occurred"):
+            raise RuntimeError(text)
+    return run
+
+
+def summarize_scenario(workdir):
+    module = load_script("4_llm_cli_utility.py")
+    document = os.path.join(workdir, "document.md")
+    with open(document, "w", encoding="utf-8") as f:
+        for chapter in range(12):
+            f.write(f"# Chapter {chapter}\n\n" + " ".join(mock_provider.WORDS * 40) + "\n\n")
+
+    def run(i):
+        # About 12 chunks of 2000 tokens: one map request per chunk and a reduce request
+        module.main([document, "-f", os.path.join(workdir, f"summary_{i}.txt"), "--chunk-tokens", "2000"])
+    return run
+
+
+def imagegen_scenario(workdir):
+    module = load_script("6_image_generator_cli-Grok.py")
+    output_dir = os.path.join(workdir, "images")
+
+    def run(i):
+        module.generate_images(f"A lighthouse at dawn, variation {i}", "1:1", 1, max_workers=1, output_dir=output_dir)
+    return run
+
+
+def interpreter_scenario(workdir):
+    import numpy as np
+    import audio_utils
+
+    module = load_script("7_interpreter.py")
+    t = np.arange(int(1.5 * audio_utils.RATE)) / audio_utils.RATE
+    samples = (6000 * np.sin(2 * np.pi * 180 * t) * (np.sin(2 * np.pi * 4 * t) > 0)).astype(np.int16)
+    segment = audio_utils.WavBuffer(samples.nbytes)
+    segment.append(samples.view(np.uint8))
+
+    def run(i):
+        _, _, speech = module.process_segment(segment, "English", "French")
+        for _ in speech or ():  # the speech is streamed; download it as playback would
+            pass
+    return run
+
+
+def dictionary_scenario(workdir):
+    module = load_script("10_dictionary_app.py")
+
+    def run(i):
+        if not module.lookup_word(f"word{i}"):
+            raise RuntimeError("empty answer")
+    return run
+
+
+SCENARIOS = {
+    "creative": creative_scenario,
+    "stream": lambda workdir: creative_scenario(workdir, stream=True),
+    "summarize": summarize_scenario,
+    "imagegen": imagegen_scenario,
+    "interpreter": interpreter_scenario,
+    "dictionary": dictionary_scenario,
+}
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def run_level(operation, concurrency, requests, offset=0):
+    """Runs `requests` operations with `concurrency` threads and returns the latency statistics."""
+    latencies, errors = [], []
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            operation(offset + i)
+        except (Exception, SystemExit) as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            return
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(requests)))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "throughput": len(latencies) / wall if wall else 0.0,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Returns the regressions of `results` against `baseline` as readable lines."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base or not base["p95"] or result["errors"] == result["requests"]:
+            continue
+        if result["p95"] > base["p95"] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {base['p95'] * 1000:.0f} ms -> {result['p95'] * 1000:.0f} ms")
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {base['throughput']:.1f}/s -> {result['throughput']:.1f}/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scripts offline against the mock provider.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated list of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="Operations per scenario and concurrency level")
+    parser.add_argument("--latency", default="lognormal:200:0.5", help="Mock response latency distribution")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="Mock seconds between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock requests answered with 429")
+    parser.add_argument("--url", help="Use an already running mock server instead of starting one")
+    parser.add_argument("--json", metavar="FILE", help="Save the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare with the results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    server = None
+    url = args.url
+    if not url:
+        config = mock_provider.MockConfig(args.latency, token_delay=args.token_delay, error_rate=args.error_rate)
+        server = mock_provider.start_server(config)
+        url = server.url
+    workdir = tempfile.mkdtemp(prefix="rajapinnat-bench-")
+    configure_environment(url, workdir)
+    print(f"Mock provider at {url}, latency {args.latency}, 429 rate {args.error_rate:.0%}")
+
+    results = {}
+    print(f"\n{'scenario':<12}{'conc':>5}{'reqs':>6}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ops/s':>8}")
+    for name in names:
+        messages = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(messages):
+                operation = SCENARIOS[name](workdir)
+                operation(-1)  # warm up: imports, connections, caches
+        except (Exception, SystemExit) as e:
+            reason = messages.getvalue().strip().splitlines()[:1] or [f"{type(e).__name__}: {e}"]
+            print(f"{name:<12} skipped: {reason[0]}")
+            continue
+        for concurrency in levels:
+            # The scripts print their results; keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                result = run_level(operation, concurrency, args.requests, offset=concurrency * args.requests)
+            results[f"{name}@{concurrency}"] = result
+            print(f"{name:<12}{concurrency:>5}{result['requests']:>6}{result['errors']:>5}"
+                  f"{result['p50'] * 1000:>9.0f}{result['p95'] * 1000:>9.0f}{result['p99'] * 1000:>9.0f}"
+                  f"{result['throughput']:>8.1f}")
+            if result["first_error"]:
+                print(f"{'':<12}first error: {result['first_error'][:100]}")
+
+    if server is not None:
+        print(f"\nMock requests: {dict(server.counters)}")
+        server.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
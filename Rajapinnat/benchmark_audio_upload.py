@@ -0,0 +1,82 @@
+import argparse
+import sys
+import time
+import wave
+
+import numpy as np
+
+import audio_utils
+
+# (label, upload format, sample rate; None keeps the recording rate)
+VARIANTS = [
+    ("wav 44.1 kHz", "wav", None),
+    ("wav 16 kHz", "wav", audio_utils.UPLOAD_RATE),
+    ("flac 16 kHz", "flac", audio_utils.UPLOAD_RATE),
+    ("opus 16 kHz", "opus", audio_utils.UPLOAD_RATE),
+]
+
+def load_wav(path):
+    """Reads a 16-bit WAV file and returns (mono samples, sample rate)."""
+    with wave.open(path, 'rb') as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError("Only 16-bit WAV files are supported")
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        channels = wf.getnchannels()
+        rate = wf.getframerate()
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples, rate
+
+def synthetic_speech(seconds, rate=audio_utils.RATE):
+    """Speech-like test signal: voiced harmonics with a syllable rhythm, pauses and background noise."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * rate)) / rate
+    pitch = 120 + 20 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 12))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) * (np.sin(2 * np.pi * 0.3 * t) > -0.3)
+    signal = 6000 * voice * syllables + 200 * rng.standard_normal(t.size)
+    return np.clip(signal, -32768, 32767).astype(np.int16)
+
+def transcribe(name, data, mime):
+    from llm_clients import get_openai_client
+    start = time.perf_counter()
+    get_openai_client().audio.transcriptions.create(model="whisper-1", file=(name, bytes(data), mime))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare upload size and transcription latency of the audio upload formats.")
+    parser.add_argument('wav', nargs='?', help='16-bit WAV recording to test (default: 10 s synthetic speech)')
+    parser.add_argument('--seconds', type=float, default=10, help='Length of the synthetic test signal')
+    parser.add_argument('--transcribe', action='store_true', help='Also measure Whisper transcription latency (needs OPENAI_API_KEY)')
+    parser.add_argument('--repeat', type=int, default=3, help='Transcription requests per format')
+    args = parser.parse_args()
+
+    if args.wav:
+        samples, rate = load_wav(args.wav)
+    else:
+        samples, rate = synthetic_speech(args.seconds), audio_utils.RATE
+    pcm = samples.tobytes()
+    print(f"Input: {len(samples) / rate:.1f} s at {rate} Hz, {len(pcm) + audio_utils.WAV_HEADER_SIZE} bytes as WAV\n")
+
+    baseline = None
+    print(f"{'format':<14}{'bytes':>10}{'ratio':>8}{'encode ms':>11}{'upload+ASR s':>14}")
+    for label, fmt, target_rate in VARIANTS:
+        start = time.perf_counter()
+        name, data, mime = audio_utils.encode_audio(pcm, rate, fmt, target_rate or rate)
+        encode_ms = (time.perf_counter() - start) * 1000
+        if fmt != "wav" and name == audio_utils.UPLOAD_FORMATS["wav"][0]:
+            print(f"{label:<14}{'(codec not available, needs soundfile)':>43}")
+            continue
+        baseline = baseline or len(data)
+        latency = ""
+        if args.transcribe:
+            try:
+                latency = f"{min(transcribe(name, data, mime) for _ in range(args.repeat)):.2f}"
+            except Exception as e:
+                print(f"Transcription failed: {e}", file=sys.stderr)
+                latency = "error"
+        print(f"{label:<14}{len(data):>10}{baseline / len(data):>7.1f}x{encode_ms:>11.1f}{latency:>14}")
+
+if __name__ == "__main__":
+    main()
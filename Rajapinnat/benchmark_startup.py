@@ -0,0 +1,96 @@
+"""
+Start-up time of the cli.py subcommands.
+
+Runs `python cli.py <command> --help` repeatedly in fresh interpreters and
+reports the median and fastest wall time next to a bare `python -c pass`,
+which is the floor no script can go below. One extra run per command uses
+`python -X importtime` to list the imports that cost the most, leaving out
+those the bare interpreter loads as well.
+
+With --budget the exit status is 1 when a command's median start-up time is
+above the budget, so a slow top-level import can be caught before it ships.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import cli
+
+CLI = os.path.join(cli.HERE, "cli.py")
+
+
+def wall_times(cmd, runs):
+    """Runs `cmd` `runs` times and returns the wall times in seconds."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_profile(cmd):
+    """Runs `cmd` under -X importtime and returns {module: cumulative microseconds}."""
+    result = subprocess.run([sys.executable, "-X", "importtime", *cmd[1:]],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    profile = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        profile[name.strip()] = int(cumulative)
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the start-up time of the cli.py subcommands.")
+    parser.add_argument("commands", nargs="*", help=f"Commands to measure (default: all of {', '.join(cli.COMMANDS)})")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per command")
+    parser.add_argument("--top", type=int, default=5, help="Slowest imports listed per command")
+    parser.add_argument("--budget", type=float, metavar="MS", help="Fail when a command's median start-up time is above MS")
+    parser.add_argument("--json", metavar="FILE", help="Save the results as JSON")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.commands if name not in cli.COMMANDS]
+    if unknown:
+        parser.error(f"unknown commands: {', '.join(unknown)}")
+
+    bare = [sys.executable, "-c", "pass"]
+    baseline_imports = set(import_profile(bare))
+    targets = [("python -c pass", bare), ("cli.py --help", [sys.executable, CLI, "--help"])]
+    targets += [(f"{name} --help", [sys.executable, CLI, name, "--help"]) for name in args.commands or cli.COMMANDS]
+
+    results = {}
+    print(f"{'command':<22}{'median ms':>10}{'min ms':>8}{'imports':>9}  slowest imports (cumulative ms)")
+    for label, cmd in targets:
+        try:
+            times = wall_times(cmd, args.runs)
+        except subprocess.CalledProcessError as e:
+            print(f"{label:<22} failed with exit status {e.returncode}")
+            continue
+        profile = {name: us for name, us in import_profile(cmd).items() if name not in baseline_imports}
+        slowest = sorted(profile.items(), key=lambda item: -item[1])[:args.top]
+        results[label] = {"median": statistics.median(times), "min": min(times), "imports": len(profile),
+                          "slowest": dict(slowest)}
+        print(f"{label:<22}{statistics.median(times) * 1000:>10.1f}{min(times) * 1000:>8.1f}{len(profile):>9}  "
+              + ", ".join(f"{name} {us / 1000:.1f}" for name, us in slowest))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.budget:
+        over = [label for label, result in results.items() if result["median"] * 1000 > args.budget]
+        if over:
+            print(f"\nOver the {args.budget:g} ms budget: {', '.join(over)}")
+            sys.exit(1)
+        print(f"\nAll commands start within {args.budget:g} ms.")
+
+
+if __name__ == "__main__":
+    main()
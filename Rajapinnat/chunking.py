@@ -0,0 +1,79 @@
+"""
+Splits Markdown text into chunks that fit a token budget.
+
+Chunks are cut at Markdown heading boundaries where possible. Sections that
+are too large on their own are split further at paragraph, line and word
+boundaries. Token counts use tiktoken when it is installed and a four
+characters per token estimate otherwise.
+"""
+
+import re
+
+HEADING = re.compile(r"^#{1,6}\s", re.MULTILINE)
+SEPARATORS = ["\n\n", "\n", " "]
+
+_encoding = None
+
+
+def count_tokens(text):
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def pack(texts, max_tokens, separator="\n\n"):
+    """Groups consecutive texts so that each group stays under `max_tokens`. Returns a list of lists."""
+    groups = []
+    current, current_tokens = [], 0
+    separator_tokens = count_tokens(separator)
+    for text in texts:
+        tokens = count_tokens(text)
+        if current and current_tokens + separator_tokens + tokens > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens + separator_tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _split_oversized(text, max_tokens, separators=SEPARATORS):
+    """Splits a single piece of text that is larger than `max_tokens`."""
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    if not separators:
+        # No natural boundary left, cut by characters
+        size = max(1, max_tokens * 4)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    separator, rest = separators[0], separators[1:]
+    parts = text.split(separator)
+    # Keep the separators so that joining the chunks gives back the original text
+    parts = [part + separator for part in parts[:-1]] + [parts[-1]]
+    pieces = []
+    for part in parts:
+        if part:
+            pieces.extend(_split_oversized(part, max_tokens, rest))
+    return ["".join(group) for group in pack(pieces, max_tokens, separator="")]
+
+
+def split_markdown(text, max_tokens):
+    """Splits Markdown into chunks of at most about `max_tokens` tokens, preferring heading boundaries."""
+    starts = [match.start() for match in HEADING.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    sections = [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+
+    pieces = []
+    for section in sections:
+        if section.strip():
+            pieces.extend(_split_oversized(section, max_tokens))
+    return ["".join(group) for group in pack(pieces, max_tokens, separator="")]
@@ -0,0 +1,73 @@
+"""
+One command line entry point for the scripts.
+
+    python cli.py dictionary -b words.txt
+    python cli.py summarize report.pdf -q "What are the key findings?"
+    python cli.py imagegen --prompt "A lighthouse at dawn" --num_images 2
+
+Every subcommand is one of the numbered scripts. Nothing is imported until a
+subcommand is chosen, and then only that script (which in turn imports its
+heavy dependencies, such as google-genai or numpy, only when they are
+needed), so `--help` and the light subcommands start quickly. Everything
+after the subcommand name is passed to the script's own argument parser.
+
+Use benchmark_startup.py to measure the start-up time of each subcommand.
+"""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# subcommand: (script, short description)
+COMMANDS = {
+    "dictionary": ("10_dictionary_app.py", "Look up words in a Gemini powered dictionary"),
+    "write": ("3_creative_writer – OpenAI.py", "Generate creative text with several parameter sets"),
+    "summarize": ("4_llm_cli_utility.py", "Query an LLM about documents and URLs"),
+    "imagegen": ("6_image_generator_cli-Grok.py", "Generate images with DALL-E 3"),
+    "interpret": ("7_interpreter.py", "Speech to speech interpreter"),
+    "describe": ("9_image_description_generator.py", "Product descriptions and slogans from images"),
+    "article": ("11_scientific_article_generator.py", "Scientific article as Markdown and PDF"),
+}
+
+
+def usage(out=None):
+    out = out or sys.stdout
+    prog = os.path.basename(sys.argv[0])
+    print(f"usage: {prog} <command> [options]\n\ncommands:", file=out)
+    for name, (_, description) in COMMANDS.items():
+        print(f"  {name:<12}{description}", file=out)
+    print(f"\nRun '{prog} <command> --help' for the options of a command.", file=out)
+
+
+def load_command(name):
+    """Imports the script behind subcommand `name` and returns it as a module."""
+    import importlib.util
+
+    filename = COMMANDS[name][0]
+    if HERE not in sys.path:
+        sys.path.insert(0, HERE)  # the scripts import the shared modules next to them
+    spec = importlib.util.spec_from_file_location(f"rajapinnat_{name}", os.path.join(HERE, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        usage()
+        return
+    name, rest = argv[0], argv[1:]
+    if name not in COMMANDS:
+        print(f"Unknown command: {name}\n", file=sys.stderr)
+        usage(sys.stderr)
+        sys.exit(2)
+
+    # The scripts' argument parsers take their program name from sys.argv[0]
+    sys.argv = [f"{os.path.basename(sys.argv[0])} {name}", *rest]
+    load_command(name).main(rest)
+
+
+if __name__ == "__main__":
+    main()
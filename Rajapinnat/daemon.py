@@ -0,0 +1,365 @@
+"""
+Long-running local server for the dictionary, the creative writer and the
+document summarizer.
+
+Every run of a script is a new process that imports its libraries, creates
+its API clients and opens its caches before doing any work. The daemon does
+that once and keeps it warm: the provider clients and their connection
+pools, the dictionary's response cache and the documents converted to
+Markdown (re-converted only when the file changes). daemon_client.py is the
+thin client that talks to it.
+
+Identical requests that arrive while the first one is still running are
+coalesced ("single flight"): they wait for that request and share its
+answer, so many callers asking for the same word cost one upstream call.
+
+The server speaks HTTP with JSON bodies, on a Unix socket or on localhost:
+    POST /dictionary  {"word": "koira"}
+    POST /write       {"prompt": "...", "model": "gpt-3.5-turbo"}
+    POST /summarize   {"inputs": ["/abs/report.pdf"], "query": "...", "citations": false,
+                       "chunk_tokens": 12000, "max_tokens": 1000}
+    GET  /status
+Answers are {"result": ...}, or {"error": "..."} with status 400 or 502.
+
+The address is taken from --address or RAJAPINNAT_DAEMON, for example
+"unix:/tmp/rajapinnat.sock" or "127.0.0.1:8766". The default is the socket
+daemon.sock in the cache directory, readable only by its owner (TCP on
+127.0.0.1:8766 where Unix sockets are not available).
+
+Anything that can reach the daemon can spend API credits and read local
+files through /summarize, so:
+  - on TCP every request must carry "Authorization: Bearer <token>", with
+    the token that the daemon writes to daemon.token (mode 0600) in the
+    cache directory when it starts,
+  - POST bodies must be sent as application/json and the Host header must
+    be local, so that a web page cannot reach the daemon with a "simple"
+    cross-site request or through DNS rebinding.
+"""
+
+import argparse
+import hmac
+import json
+import os
+import re
+import secrets
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cli
+from document_loader import convert_sources, is_url
+from instrumentation import count, stage
+from llm_clients import get_gemini_client, get_openai_client
+from request_scheduler import call
+from response_cache import ResponseCache, cache_dir
+
+if hasattr(socket, "AF_UNIX"):
+    DEFAULT_ADDRESS = "unix:" + os.path.join(cache_dir(), "daemon.sock")
+else:
+    DEFAULT_ADDRESS = "127.0.0.1:8766"
+TOKEN_FILE = os.path.join(cache_dir(), "daemon.token")
+LOCAL_HOST = re.compile(r"^(localhost|127\.0\.0\.1|\[::1\])(:\d+)?$", re.IGNORECASE)
+MAX_BODY = 1 << 20
+BACKLOG = 128  # many clients connect at once from shell pipelines
+
+
+class SingleFlight:
+    """Runs one call per key at a time. Callers asking for a key already in flight share its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            count("daemon.single_flight", shared=1)
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class Daemon:
+    """The warm state and the operations served by the HTTP handler."""
+
+    def __init__(self, cache_file=None, max_documents=256, workers=8):
+        self.dictionary = cli.load_command("dictionary")
+        self.writer = cli.load_command("write")
+        self.summarizer = cli.load_command("summarize")
+        self.cache = ResponseCache(cache_file or os.path.join(cache_dir(), "dictionary.sqlite3"))
+        self.flights = SingleFlight()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_documents = max_documents
+        self.documents = OrderedDict()  # source -> (file signature, Markdown)
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self.started = time.time()
+
+        # Create the clients now so that the first request does not pay for it
+        for factory in (get_openai_client, get_gemini_client):
+            try:
+                factory()
+            except Exception as e:
+                print(f"Warning: {factory.__name__}() failed: {e}", file=sys.stderr)
+
+    def handle(self, operation, request):
+        """Runs `operation` with the decoded JSON `request` and returns the result."""
+        handlers = {"dictionary": self.lookup, "write": self.write, "summarize": self.summarize}
+        if operation not in handlers:
+            raise KeyError(f"Unknown operation: {operation}")
+        with self._lock:
+            self.requests[operation] += 1
+        with stage(f"daemon.{operation}"):
+            return handlers[operation](request)
+
+    def lookup(self, request):
+        word = str(request["word"]).strip()
+        if not word:
+            raise ValueError("Empty word")
+        key = ("dictionary", self.dictionary.normalize_word(word))
+        return self.flights.do(key, self.dictionary.lookup_word, word, self.cache)
+
+    def write(self, request):
+        prompt = str(request["prompt"])
+        model = request.get("model") or self.writer.MODEL
+        configs = request.get("configs") or self.writer.CONFIGS
+
+        def version(config):
+            key = ("write", prompt, model, tuple(sorted(config.items())))
+            return self.flights.do(key, self.writer.generate_creative_content, prompt, model,
+                                   config["temperature"], config["top_p"],
+                                   config["presence_penalty"], config["frequency_penalty"])
+        return list(self.executor.map(version, configs))
+
+    def _signature(self, source):
+        if is_url(source):
+            return None
+        stat = os.stat(source)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load_documents(self, sources):
+        """Returns (source, text, error) for every source, converting only new or changed files."""
+        results, signatures, convert = {}, {}, []
+        with self._lock:
+            for source in dict.fromkeys(sources):
+                try:
+                    signatures[source] = self._signature(source)
+                except OSError as e:
+                    results[source] = (None, e)
+                    continue
+                entry = self.documents.get(source)
+                if entry is not None and signatures[source] is not None and entry[0] == signatures[source]:
+                    self.documents.move_to_end(source)
+                    results[source] = (entry[1], None)
+                else:
+                    convert.append(source)
+        count("daemon.documents", cache_hits=len(signatures) - len(convert), cache_misses=len(convert))
+
+        for source, text, error in convert_sources(convert):
+            results[source] = (text, error)
+            if error is None and signatures[source] is not None:
+                with self._lock:
+                    self.documents[source] = (signatures[source], text)
+                    self.documents.move_to_end(source)
+                    while len(self.documents) > self.max_documents:
+                        self.documents.popitem(last=False)
+        return [(source, *results[source]) for source in sources]
+
+    def summarize(self, request):
+        inputs = [str(source) for source in request["inputs"]]
+        query = request.get("query") or "Summarize the following content:"
+        citations = bool(request.get("citations"))
+        chunk_tokens = int(request.get("chunk_tokens") or 12000)
+        max_tokens = int(request.get("max_tokens") or 1000)
+        if not inputs:
+            raise ValueError("No inputs")
+
+        def run():
+            documents, errors = [], []
+            for source, text, error in self.load_documents(inputs):
+                if error is not None:
+                    errors.append(f"{source}: {error}")
+                else:
+                    documents.append((source, text))
+            if not any(text.strip() for _, text in documents):
+                raise ValueError("No content to process. " + "; ".join(errors))
+            client = get_openai_client()
+            params, sources = self.summarizer.prepare_request(client, documents, query, citations, chunk_tokens, max_tokens)
+            response = call(f"openai:{params['model']}", client.chat.completions.create, **params)
+            return response.choices[0].message.content + sources
+
+        # Same inputs in the same state and same question: one upstream request
+        signatures = []
+        for source in inputs:
+            try:
+                signatures.append(self._signature(source))
+            except OSError:
+                signatures.append(None)
+        key = ("summarize", tuple(inputs), tuple(signatures), query, citations, chunk_tokens, max_tokens)
+        return self.flights.do(key, run)
+
+    def status(self):
+        with self._lock:
+            requests = dict(self.requests)
+            documents = len(self.documents)
+        return {"uptime": round(time.time() - self.started, 1), "requests": requests,
+                "coalesced": self.flights.shared, "documents": documents, "dictionary_cache": self.cache.stats()}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.cache.close()
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so a client can send many requests on one connection
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _refuse(self):
+        """Sends an error and returns True if the request must not be served."""
+        if not LOCAL_HOST.match(self.headers.get("Host") or ""):
+            error, status = "Host not allowed", 403
+        elif self.server.token and not hmac.compare_digest(
+                self.headers.get("Authorization") or "", f"Bearer {self.server.token}"):
+            error, status = "Missing or wrong token", 401
+        elif self.command == "POST" and self.headers.get_content_type() != "application/json":
+            error, status = "Content-Type must be application/json", 415
+        else:
+            return False
+        self.close_connection = True  # the body, if any, is not read
+        self._send_json({"error": error}, status=status)
+        return True
+
+    def do_GET(self):
+        if self._refuse():
+            return
+        if self.path.split("?")[0] == "/status":
+            self._send_json({"result": self.server.daemon.status()})
+        else:
+            self._send_json({"error": f"Unknown path {self.path}"}, status=404)
+
+    def do_POST(self):
+        if self._refuse():
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            self.close_connection = True
+            self._send_json({"error": "Request too large"}, status=413)
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+            result = self.server.daemon.handle(self.path.strip("/"), request)
+        except (KeyError, ValueError, TypeError) as e:
+            self._send_json({"error": f"{type(e).__name__}: {e}"}, status=400)
+        except Exception as e:
+            self._send_json({"error": f"{type(e).__name__}: {e}"}, status=502)
+        else:
+            self._send_json({"result": result})
+
+
+class TCPDaemonHandler(DaemonHandler):
+    # Headers and body are separate writes; with Nagle and delayed ACKs every request would wait ~40 ms
+    disable_nagle_algorithm = True  # TCP only, the option does not exist for Unix sockets
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = BACKLOG
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)  # BaseHTTPRequestHandler expects a (host, port) address
+
+
+class TCPHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = BACKLOG
+
+
+def write_token(path=TOKEN_FILE):
+    """Writes a new random token to `path`, readable only by the owner, and returns it."""
+    token = secrets.token_hex(32)
+    if os.path.exists(path):
+        os.remove(path)  # so that the new file is created with mode 0600
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    return token
+
+
+def make_server(address, daemon):
+    """
+    Creates the HTTP server for `address` ("host:port" or "unix:PATH").
+    A TCP server requires the token written to TOKEN_FILE; access to a Unix
+    socket is limited by its file mode instead.
+    """
+    if address.startswith("unix:"):
+        path = address[len("unix:"):]
+        if os.path.exists(path):
+            os.remove(path)  # left behind by an earlier run
+        server = UnixHTTPServer(path, DaemonHandler)
+        os.chmod(path, 0o600)
+        server.token = None
+    else:
+        host, _, port = address.rpartition(":")
+        server = TCPHTTPServer((host or "127.0.0.1", int(port)), TCPDaemonHandler)
+        server.token = write_token()
+    server.daemon = daemon
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the dictionary, writer and summarizer from one warm process.")
+    parser.add_argument("--address", default=os.getenv("RAJAPINNAT_DAEMON", DEFAULT_ADDRESS),
+                        help=f"host:port or unix:PATH (default: RAJAPINNAT_DAEMON or {DEFAULT_ADDRESS})")
+    parser.add_argument("--cache-file", help="Path of the dictionary response cache database")
+    parser.add_argument("--max-documents", type=int, default=256, help="Converted documents kept in memory")
+    parser.add_argument("--workers", type=int, default=8, help="Threads for the writer's parallel versions")
+    args = parser.parse_args(argv)
+
+    daemon = Daemon(args.cache_file, args.max_documents, args.workers)
+    server = make_server(args.address, daemon)
+    print(f"Listening on {args.address}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.address.startswith("unix:"):
+            os.remove(args.address[len("unix:"):])
+        daemon.close()
+
+
+if __name__ == "__main__":
+    main()
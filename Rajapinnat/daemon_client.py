@@ -0,0 +1,125 @@
+"""
+Thin client for daemon.py.
+
+    python daemon_client.py dictionary koira cat house
+    python daemon_client.py write "A story about a lighthouse"
+    python daemon_client.py summarize report.pdf notes.md -q "Key findings?"
+    python daemon_client.py status
+
+Only the standard library is imported, so a call costs about as much as
+starting the interpreter; the API clients, caches and converted documents
+live in the daemon. The address is taken from --address or
+RAJAPINNAT_DAEMON ("host:port" or "unix:PATH"); over TCP the token from
+daemon.token in the cache directory is sent with every request.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+
+# Same locations as daemon.py, without importing response_cache
+CACHE_DIR = os.getenv("RAJAPINNAT_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "rajapinnat")
+if hasattr(socket, "AF_UNIX"):
+    DEFAULT_ADDRESS = "unix:" + os.path.join(CACHE_DIR, "daemon.sock")
+else:
+    DEFAULT_ADDRESS = "127.0.0.1:8766"
+TOKEN_FILE = os.path.join(CACHE_DIR, "daemon.token")
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class DaemonClient:
+    """Sends requests to the daemon over one keep-alive connection."""
+
+    def __init__(self, address=None, timeout=600):
+        address = address or os.getenv("RAJAPINNAT_DAEMON", DEFAULT_ADDRESS)
+        self.headers = {}
+        if address.startswith("unix:"):
+            self.connection = UnixHTTPConnection(address[len("unix:"):], timeout=timeout)
+        else:
+            host, _, port = address.rpartition(":")
+            self.connection = http.client.HTTPConnection(host or "127.0.0.1", int(port), timeout=timeout)
+            try:
+                with open(TOKEN_FILE, encoding="utf-8") as f:
+                    self.headers["Authorization"] = f"Bearer {f.read().strip()}"
+            except OSError:
+                pass  # the daemon will answer 401
+
+    def request(self, operation, payload=None):
+        """Runs `operation` in the daemon and returns its result. Raises RuntimeError with the daemon's error."""
+        if payload is None:
+            self.connection.request("GET", f"/{operation}", headers=self.headers)
+        else:
+            body = json.dumps(payload).encode("utf-8")
+            self.connection.request("POST", f"/{operation}", body, {**self.headers, "Content-Type": "application/json"})
+        response = self.connection.getresponse()
+        answer = json.loads(response.read() or b"{}")
+        if response.status != 200:
+            raise RuntimeError(answer.get("error") or f"HTTP {response.status}")
+        return answer["result"]
+
+    def close(self):
+        self.connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send requests to a running daemon.py.")
+    parser.add_argument("--address", help=f"host:port or unix:PATH (default: RAJAPINNAT_DAEMON or {DEFAULT_ADDRESS})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    dictionary = commands.add_parser("dictionary", help="Look up words")
+    dictionary.add_argument("words", nargs="*", help="Words to look up (default: one per line from stdin)")
+
+    write = commands.add_parser("write", help="Generate creative content, one version per configuration")
+    write.add_argument("prompt")
+    write.add_argument("--model", help="Model (default: the writer's model)")
+
+    summarize = commands.add_parser("summarize", help="Query an LLM about documents and URLs")
+    summarize.add_argument("inputs", nargs="+", help="File paths or URLs")
+    summarize.add_argument("-q", "--query", default="Summarize the following content:", help="Query prompt for the LLM")
+    summarize.add_argument("-c", "--citations", action="store_true", help="Include citations in the output")
+    summarize.add_argument("--chunk-tokens", type=int, default=12000, help="Largest prompt sent in one request")
+    summarize.add_argument("--max-tokens", type=int, default=1000, help="Maximum tokens per answer")
+
+    commands.add_parser("status", help="Show the daemon's request and cache statistics")
+    args = parser.parse_args(argv)
+
+    client = DaemonClient(args.address)
+    try:
+        if args.command == "dictionary":
+            words = args.words or (line.strip() for line in sys.stdin)
+            for word in words:
+                if word:
+                    print(client.request("dictionary", {"word": word}))
+        elif args.command == "write":
+            for i, content in enumerate(client.request("write", {"prompt": args.prompt, "model": args.model})):
+                print(f"--- Version {i + 1} ---\n{content}\n")
+        elif args.command == "summarize":
+            # The daemon resolves paths in its own working directory
+            inputs = [source if source.startswith(("http://", "https://")) else os.path.abspath(source)
+                      for source in args.inputs]
+            print(client.request("summarize", {"inputs": inputs, "query": args.query, "citations": args.citations,
+                                               "chunk_tokens": args.chunk_tokens, "max_tokens": args.max_tokens}))
+        else:
+            print(json.dumps(client.request("status"), indent=2))
+    except (OSError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Converts documents and URLs to Markdown with MarkItDown.
+
+Local files are converted in a process pool because PDF/DOCX parsing is
+CPU bound, URLs are fetched in a thread pool. The results keep the order of
+the inputs. Converted Markdown is cached on disk, keyed by the file content
+hash or by the URL's ETag / Last-Modified header.
+"""
+
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import count, record
+from llm_clients import get_http_session, http_timeout
+from response_cache import cache_dir
+
+# Change this when the conversion output changes so old cache entries are ignored
+CONVERTER_VERSION = "1"
+
+_markitdown = None
+
+
+def is_url(source):
+    return source.startswith('http://') or source.startswith('https://')
+
+
+def _get_markitdown():
+    """One MarkItDown instance per process."""
+    global _markitdown
+    if _markitdown is None:
+        from markitdown import MarkItDown
+        _markitdown = MarkItDown()
+    return _markitdown
+
+
+def convert_file(path):
+    return _get_markitdown().convert(path).text_content
+
+
+def convert_url(url):
+    return _get_markitdown().convert_url(url).text_content
+
+
+def _timed(convert, source):
+    """Runs one conversion and returns (text, seconds). Module level so the process pool can pickle it."""
+    start = time.perf_counter()
+    text = convert(source)
+    return text, time.perf_counter() - start
+
+
+def file_cache_key(path):
+    """Hash of the file content (and extension, which selects the converter)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(os.path.splitext(path)[1].lower().encode("utf-8"))
+    digest.update(CONVERTER_VERSION.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def url_cache_key(url):
+    """Key built from the URL's ETag or Last-Modified header, or None if the server sends neither."""
+    try:
+        response = get_http_session().head(url, allow_redirects=True, timeout=http_timeout())
+    except Exception:
+        return None
+    validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+    if response.status_code != 200 or not validator:
+        return None
+    return hashlib.sha256(f"{url}\x1f{validator}\x1f{CONVERTER_VERSION}".encode("utf-8")).hexdigest()
+
+
+class ConversionCache:
+    """Directory of converted Markdown files named by their cache key."""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_dir(), "markdown")
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.md")
+
+    def get(self, key):
+        try:
+            with open(self._file(key), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, text):
+        tmp = f"{self._file(key)}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, self._file(key))
+
+
+def convert_sources(sources, use_cache=True, max_workers=None, verbose=False):
+    """
+    Converts all sources to Markdown in parallel.
+    Returns a list of (source, text, error) tuples in the same order as `sources`;
+    `text` is None and `error` is set when a source could not be converted.
+    """
+    cache = ConversionCache()
+    results = [None] * len(sources)
+    keys = {}
+    files, urls = [], []
+
+    for i, source in enumerate(sources):
+        if is_url(source):
+            urls.append(i)  # the cache key needs a HEAD request, made in the thread pool
+            continue
+        try:
+            key = file_cache_key(source)
+        except OSError as e:
+            results[i] = (source, None, e)
+            continue
+        keys[i] = key
+        cached = cache.get(key) if use_cache and key else None
+        count("cache.conversion", cache_hits=cached is not None, cache_misses=cached is None)
+        if cached is not None:
+            if verbose:
+                print(f"Processing: {source} (cached)", file=sys.stderr)
+            results[i] = (source, cached, None)
+        else:
+            files.append(i)
+
+    def convert_url_cached(i):
+        """Looks up or converts one URL. Returns (text, seconds); seconds is None for a cache hit."""
+        source = sources[i]
+        keys[i] = url_cache_key(source)
+        cached = cache.get(keys[i]) if use_cache and keys[i] else None
+        count("cache.conversion", cache_hits=cached is not None, cache_misses=cached is None)
+        if cached is not None:
+            if verbose:
+                print(f"Processing: {source} (cached)", file=sys.stderr)
+            return cached, None
+        if verbose:
+            print(f"Processing: {source}", file=sys.stderr)
+        return _timed(convert_url, source)
+
+    def collect(futures):
+        for i, future in futures.items():
+            source = sources[i]
+            try:
+                text, seconds = future.result()
+            except Exception as e:
+                record("convert", 0.0, {"source": source}, error=type(e).__name__)
+                results[i] = (source, None, e)
+                continue
+            if seconds is None:
+                results[i] = (source, text, None)
+                continue
+            # Timed in the worker, recorded here because worker processes do not share the statistics
+            record("convert", seconds, {"source": source}, bytes_in=0 if is_url(source) else os.path.getsize(source),
+                   bytes_out=len(text.encode("utf-8")))
+            if keys.get(i):
+                cache.put(keys[i], text)
+            results[i] = (source, text, None)
+
+    # Only start worker processes when there is more than one file to parse
+    process_pool = None
+    if len(files) > 1:
+        from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing, import only when used
+        process_pool = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers or 8) as thread_pool:
+            file_futures = {}
+            for i in files:
+                if verbose:
+                    print(f"Processing: {sources[i]}", file=sys.stderr)
+                pool = process_pool or thread_pool
+                file_futures[i] = pool.submit(_timed, convert_file, sources[i])
+            url_futures = {}
+            for i in urls:
+                url_futures[i] = thread_pool.submit(convert_url_cached, i)
+            collect(file_futures)
+            collect(url_futures)
+    finally:
+        if process_pool is not None:
+            process_pool.shutdown()
+
+    return results
@@ -0,0 +1,169 @@
+"""
+Local vector index for retrieval-augmented queries.
+
+An index directory contains:
+    embeddings.f32  chunk embeddings as float32 rows, read with np.memmap
+    offsets.i64     byte offset of every chunk record in chunks.jsonl
+    chunks.jsonl    chunk text and source, one JSON object per line
+    index.json      embedder, dimension, row count and the indexed sources
+
+The files are only ever appended to, so adding documents does not rewrite
+the existing index. When a source changes, its new chunks are appended and
+the old rows are simply no longer referenced.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from chunking import split_markdown
+
+LOCAL_DIM = 512
+OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
+OPENAI_DIM = 1536
+
+
+def local_embed(texts, dim=LOCAL_DIM):
+    """
+    Deterministic offline embedding: hashed word unigrams and bigrams with
+    sublinear term weighting. Needs no network access or model download.
+    """
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = re.findall(r"\w+", text.casefold())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        if not features:
+            continue
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "little") for f in features],
+            dtype=np.uint64,
+        )
+        buckets = (hashes % np.uint64(dim)).astype(np.int64)
+        signs = np.where(hashes >> np.uint64(63), 1.0, -1.0).astype(np.float32)
+        np.add.at(vectors[row], buckets, signs)
+    vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+    return _normalize(vectors)
+
+
+def openai_embed(texts, batch_size=100):
+    from llm_clients import get_openai_client
+    from request_scheduler import call
+
+    client = get_openai_client()
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        response = call(f"openai:{OPENAI_EMBEDDING_MODEL}", client.embeddings.create,
+                        model=OPENAI_EMBEDDING_MODEL, input=texts[i:i + batch_size])
+        vectors.extend(item.embedding for item in response.data)
+    return _normalize(np.array(vectors, dtype=np.float32).reshape(len(texts), OPENAI_DIM))
+
+
+EMBEDDERS = {
+    "local": (local_embed, LOCAL_DIM),
+    "openai": (openai_embed, OPENAI_DIM),
+}
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+class EmbeddingIndex:
+    def __init__(self, path, embedder=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.meta_file = os.path.join(path, "index.json")
+        self.vectors_file = os.path.join(path, "embeddings.f32")
+        self.offsets_file = os.path.join(path, "offsets.i64")
+        self.chunks_file = os.path.join(path, "chunks.jsonl")
+
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, encoding="utf-8") as f:
+                self.meta = json.load(f)
+            if embedder and embedder != self.meta["embedder"]:
+                raise ValueError(f"Index {path} was built with '{self.meta['embedder']}' embeddings, not '{embedder}'")
+        else:
+            if not embedder:
+                embedder = "openai" if os.getenv("OPENAI_API_KEY") else "local"
+            self.meta = {"embedder": embedder, "dim": EMBEDDERS[embedder][1], "count": 0, "chunks_size": 0, "sources": {}}
+        self.embed = EMBEDDERS[self.meta["embedder"]][0]
+        self.dim = self.meta["dim"]
+
+    def _save_meta(self):
+        tmp = self.meta_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp, self.meta_file)
+
+    def _append(self, filename, expected_size, data):
+        """Appends data after the last committed byte, dropping any partial write left by a crash."""
+        with open(filename, "ab+") as f:
+            f.truncate(expected_size)
+            f.seek(expected_size)
+            f.write(data)
+
+    def add(self, source, text, chunk_tokens=800):
+        """Indexes a document unless the same content is already indexed. Returns the number of new chunks."""
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        known = self.meta["sources"].get(source)
+        if known and known["digest"] == digest:
+            return 0
+
+        chunks = [chunk for chunk in split_markdown(text, chunk_tokens) if chunk.strip()]
+        if not chunks:
+            return 0
+        vectors = self.embed(chunks)
+
+        count = self.meta["count"]
+        offset = self.meta["chunks_size"]
+        records = bytearray()
+        offsets = []
+        for chunk in chunks:
+            offsets.append(offset + len(records))
+            records += (json.dumps({"source": source, "text": chunk}, ensure_ascii=False) + "\n").encode("utf-8")
+
+        self._append(self.vectors_file, count * self.dim * 4, vectors.astype(np.float32).tobytes())
+        self._append(self.offsets_file, count * 8, np.array(offsets, dtype=np.int64).tobytes())
+        self._append(self.chunks_file, offset, bytes(records))
+
+        self.meta["sources"][source] = {"digest": digest, "rows": [count, count + len(chunks)]}
+        self.meta["count"] = count + len(chunks)
+        self.meta["chunks_size"] = offset + len(records)
+        self._save_meta()
+        return len(chunks)
+
+    def search(self, query, top_k=8):
+        """Returns the `top_k` chunks most similar to `query` as dicts with source, text and score."""
+        count = self.meta["count"]
+        if count == 0:
+            return []
+        vectors = np.memmap(self.vectors_file, dtype=np.float32, mode="r", shape=(count, self.dim))
+        scores = vectors @ self.embed([query])[0]
+
+        # Rows of replaced documents are no longer referenced by any source
+        live = np.zeros(count, dtype=bool)
+        for info in self.meta["sources"].values():
+            start, end = info["rows"]
+            live[start:end] = True
+        scores[~live] = -np.inf
+
+        top_k = min(top_k, int(live.sum()))
+        if top_k <= 0:
+            return []
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+
+        offsets = np.memmap(self.offsets_file, dtype=np.int64, mode="r", shape=(count,))
+        results = []
+        with open(self.chunks_file, "rb") as f:
+            for row in best:
+                f.seek(int(offsets[row]))
+                record = json.loads(f.readline())
+                record["score"] = float(scores[row])
+                results.append(record)
+        return results
@@ -0,0 +1,104 @@
+"""
+Prepares images for vision model uploads.
+
+Images are decoded, rotated according to their EXIF orientation, downscaled
+to the largest resolution the model actually uses and re-encoded as JPEG or
+WebP. The vision models resize large photos on the server anyway, so sending
+a 12 MB original only costs upload time and memory. Prepared images are
+cached on disk by content hash.
+
+Pillow is optional: without it the original bytes are sent with a MIME type
+detected from the file content.
+"""
+
+import hashlib
+import mimetypes
+import os
+from io import BytesIO
+
+from instrumentation import count, stage
+from response_cache import cache_dir
+
+# Effective input resolution of the vision models
+OPENAI_VISION = {"max_side": 2048, "max_short_side": 768}  # "high" detail: fit 2048x2048, short side 768
+GEMINI_VISION = {"max_side": 1536, "max_short_side": None}
+
+FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def sniff_mime(data, filename=None):
+    """MIME type from the file signature, falling back to the file name."""
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    guessed = mimetypes.guess_type(filename)[0] if filename else None
+    return guessed or "application/octet-stream"
+
+
+def _target_size(width, height, max_side, max_short_side):
+    scale = min(1.0, max_side / max(width, height))
+    if max_short_side:
+        scale = min(scale, max_short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale)), scale < 1.0
+
+
+def _encode(data, max_side, max_short_side, fmt, quality):
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        width, height, needs_resize = _target_size(image.width, image.height, max_side, max_short_side)
+        # Small images that are already in the target format are sent as they are
+        if not needs_resize and FORMATS.get(fmt) == sniff_mime(data):
+            return data, FORMATS[fmt]
+        if needs_resize:
+            image = image.resize((width, height), Image.LANCZOS)
+        if fmt == "JPEG" and image.mode != "RGB":
+            # JPEG has no alpha channel: put transparent images on a white background
+            background = Image.new("RGB", image.size, "white")
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+        out = BytesIO()
+        image.save(out, format=fmt, quality=quality, optimize=True)
+        return out.getvalue(), FORMATS[fmt]
+
+
+def prepare_image(path, max_side=2048, max_short_side=None, fmt="JPEG", quality=85, use_cache=True):
+    """
+    Returns (image bytes, MIME type) ready for upload. The image is downscaled
+    to fit `max_side` (and `max_short_side` if given) and re-encoded as `fmt`.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    key = hashlib.sha256(data + f"|{max_side}|{max_short_side}|{fmt}|{quality}".encode("utf-8")).hexdigest()
+    cached = os.path.join(cache_dir(), "images", f"{key}.{fmt.lower()}")
+    if use_cache and os.path.exists(cached):
+        count("cache.image", cache_hits=1)
+        with open(cached, "rb") as f:
+            return f.read(), FORMATS[fmt]
+    count("cache.image", cache_misses=use_cache)
+
+    try:
+        with stage("image_prepare", format=fmt) as span:
+            prepared, mime = _encode(data, max_side, max_short_side, fmt, quality)
+            span.add(bytes_in=len(data), bytes_out=len(prepared))
+    except Exception:
+        # Pillow missing or the format is not supported: send the original file
+        return data, sniff_mime(data, path)
+
+    if use_cache and prepared is not data:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp = f"{cached}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(prepared)
+        os.replace(tmp, cached)
+    return prepared, mime
@@ -0,0 +1,182 @@
+"""
+Content-addressed store of generated images.
+
+An image generation request is identified by a hash of its normalized
+parameters (model, prompt, size, quality, style and the variant number, so
+that asking for three images of one prompt still gives three different
+images). When the same request comes again, the stored image is returned
+at once instead of paying for a new generation and download.
+
+The images themselves are stored once per distinct content, named by the
+SHA-256 of their bytes:
+    blobs/<sha256>.png       image data
+    requests/<key>.json      request -> blob, with the request parameters
+Output files are hard links to the blobs (see OutputStore.link()), so
+repeated images take no extra disk space.
+
+The blobs are evicted least recently used first when their total size goes
+over max_bytes (IMAGE_STORE_MAX_MB, 1024 MB by default). A request whose
+blob was evicted is simply generated again. The last use is the mtime of the
+request files: a blob shares its inode (and so its mtime) with the output
+files linked to it, which must not change when the store is used. Blobs
+that are still linked into an output directory do not count toward
+max_bytes and are not evicted, because removing them would free no space.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+
+from instrumentation import count
+from response_cache import cache_dir
+
+DEFAULT_MAX_BYTES = int(float(os.getenv("IMAGE_STORE_MAX_MB", "1024")) * 1024 * 1024)
+
+
+def normalize_prompt(prompt):
+    """Normalizes Unicode and whitespace so that trivially different prompts share one entry."""
+    return " ".join(unicodedata.normalize("NFC", prompt).split())
+
+
+def request_key(model, prompt, size, quality=None, style=None, variant=0):
+    """Hash of the normalized generation request."""
+    request = {"model": model, "prompt": normalize_prompt(prompt), "size": size,
+               "quality": quality, "style": style, "variant": variant}
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ImageStore:
+    """Thread- and process-safe blob store for generated images."""
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or os.path.join(cache_dir(), "image_store")
+        self.max_bytes = max_bytes
+        self._blobs = os.path.join(self.directory, "blobs")
+        self._requests = os.path.join(self.directory, "requests")
+        self._lock = threading.Lock()
+        os.makedirs(self._blobs, exist_ok=True)
+        os.makedirs(self._requests, exist_ok=True)
+
+    def _ref(self, key):
+        return os.path.join(self._requests, f"{key}.json")
+
+    def get(self, key):
+        """Returns the path of the image stored for request `key`, or None."""
+        try:
+            with open(self._ref(key), encoding="utf-8") as f:
+                path = os.path.join(self._blobs, json.load(f)["blob"])
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            os.utime(self._ref(key))  # last use, for the LRU eviction
+        except (OSError, ValueError, KeyError):
+            count("cache.image_store", cache_misses=1)
+            return None
+        count("cache.image_store", cache_hits=1)
+        return path
+
+    def write(self, key, chunks, ext=".png", **metadata):
+        """
+        Stores the image given as an iterable of byte chunks for request `key`
+        and returns the blob path. Content that is already stored is not
+        written a second time.
+        """
+        digest = hashlib.sha256()
+        tmp = os.path.join(self._blobs, f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+            blob = f"{digest.hexdigest()}{ext}"
+            path = os.path.join(self._blobs, blob)
+            if os.path.exists(path):
+                os.remove(tmp)
+            else:
+                os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        entry = {"blob": blob, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), **metadata}
+        ref_tmp = f"{self._ref(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(ref_tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(ref_tmp, self._ref(key))
+        self.evict(keep=path)
+        return path
+
+    def put(self, key, data, ext=".png", **metadata):
+        """Stores `data` for request `key` and returns the blob path."""
+        return self.write(key, [data], ext, **metadata)
+
+    def export(self, key, output, name, prompt=None, **metadata):
+        """
+        Adds the image stored for request `key` to OutputStore `output` as a hard
+        link named after `name`. Returns the new path, or None if nothing is stored.
+        """
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            return output.link(path, name, prompt, cached=True, **metadata)
+        except FileNotFoundError:
+            return None  # evicted by another process in the meantime
+
+    def size(self):
+        """Total size of the stored images in bytes, including those linked into output directories."""
+        return sum(entry.stat().st_size for entry in os.scandir(self._blobs) if not entry.name.startswith("."))
+
+    def _last_uses(self):
+        """Returns {blob name: (last use, [request files])} from the request files."""
+        uses = {}
+        for entry in os.scandir(self._requests):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path, encoding="utf-8") as f:
+                    blob = json.load(f)["blob"]
+                used = entry.stat().st_mtime
+            except (OSError, ValueError, KeyError):
+                continue  # being replaced or removed by another process
+            last, refs = uses.get(blob, (0.0, []))
+            uses[blob] = (max(last, used), refs + [entry.path])
+        return uses
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used images (except `keep`) and their
+        requests until the images that only the store holds fit into max_bytes.
+        """
+        if not self.max_bytes:
+            return
+        with self._lock:
+            uses = self._last_uses()
+            blobs = []
+            for entry in os.scandir(self._blobs):
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    stat = os.stat(entry.path)  # DirEntry.stat() has no st_nlink on Windows
+                except FileNotFoundError:
+                    continue
+                if stat.st_nlink > 1:
+                    continue  # still linked into an output directory: removing it frees nothing
+                last, refs = uses.get(entry.name, (stat.st_mtime, []))
+                blobs.append((last, stat.st_size, entry.path, refs))
+            total = sum(size for _, size, _, _ in blobs)
+            for _, size, path, refs in sorted(blobs):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                for ref in refs + [path]:
+                    try:
+                        os.remove(ref)
+                    except FileNotFoundError:
+                        pass  # evicted by another process
+                total -= size
+                count("cache.image_store", evicted=1)
@@ -0,0 +1,258 @@
+"""
+Per-stage timings and counters shared by the scripts.
+
+Work is measured in named stages:
+
+    with stage("convert", source=path) as span:
+        text = convert(path)
+        span.add(bytes_in=size, bytes_out=len(text))
+
+Every finished stage records its wall time, whether it failed, and the
+counters added to it: bytes_sent / bytes_received for network traffic,
+bytes_in / bytes_out for local processing, prompt_tokens /
+completion_tokens, retries, cache_hits / cache_misses and so on.
+request_scheduler.call() records every API call as an "api.<provider>"
+stage, so network time can be told apart from conversion and rendering.
+
+The data is aggregated per stage and exported according to environment
+variables, so every script gets it without extra flags:
+    RAJAPINNAT_TRACE=run.jsonl      append one JSON line per finished stage
+    RAJAPINNAT_METRICS=run.prom     write Prometheus text metrics on exit
+    RAJAPINNAT_METRICS_PORT=9464    serve the metrics on http://127.0.0.1:PORT/metrics
+                                    (main process only; a port in use is a warning)
+    RAJAPINNAT_PROFILE=1            print a per-stage summary to stderr on exit
+"""
+
+import atexit
+import contextvars
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+TRACE_FILE = os.getenv("RAJAPINNAT_TRACE")
+METRICS_FILE = os.getenv("RAJAPINNAT_METRICS")
+METRICS_PORT = os.getenv("RAJAPINNAT_METRICS_PORT")
+PROFILE = os.getenv("RAJAPINNAT_PROFILE", "") not in ("", "0")
+
+TRACE_ID = os.urandom(16).hex()  # one trace per process run
+
+_current = contextvars.ContextVar("rajapinnat_span", default=None)
+_span_ids = itertools.count(1)
+_lock = threading.Lock()
+_stats = {}
+_trace = None
+
+
+class Span:
+    """One measured stage. Counters added with add() are summed."""
+
+    def __init__(self, name, labels, parent=None):
+        self.name = name
+        self.labels = labels
+        self.id = next(_span_ids)
+        self.parent = parent.id if parent is not None else None
+        self.started = time.time()
+        self.seconds = 0.0
+        self.error = None
+        self.counters = {}
+
+    def add(self, **counters):
+        for name, value in counters.items():
+            if value:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def label(self, **labels):
+        self.labels.update(labels)
+
+
+class _StageStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.counters = {}
+
+
+def _aggregate(name, seconds=None, error=None, counters=None):
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = _StageStats()
+        if seconds is not None:
+            stats.count += 1
+            stats.seconds += seconds
+            stats.errors += error is not None
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+        for counter, value in (counters or {}).items():
+            stats.counters[counter] = stats.counters.get(counter, 0) + value
+
+
+def _write_trace(span):
+    global _trace
+    entry = {"trace": TRACE_ID, "span": span.id, "parent": span.parent, "stage": span.name,
+             "start": round(span.started, 6), "seconds": round(span.seconds, 6),
+             "error": span.error, "labels": span.labels, **span.counters}
+    line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        if _trace is None:
+            _trace = open(TRACE_FILE, "a", encoding="utf-8")
+        _trace.write(line)
+        _trace.flush()
+
+
+def _finish(span):
+    _aggregate(span.name, span.seconds, span.error, span.counters)
+    if TRACE_FILE:
+        _write_trace(span)
+
+
+@contextmanager
+def stage(name, **labels):
+    """Measures the enclosed block as stage `name` and yields its Span."""
+    span = Span(name, labels, _current.get())
+    token = _current.set(span)
+    start = time.perf_counter()
+    try:
+        yield span
+    except BaseException as e:
+        span.error = type(e).__name__
+        raise
+    finally:
+        span.seconds = time.perf_counter() - start
+        _current.reset(token)
+        _finish(span)
+
+
+def record(name, seconds, labels=None, error=None, **counters):
+    """Records a stage that was timed elsewhere, for example in a worker process."""
+    span = Span(name, dict(labels or {}), _current.get())
+    span.started = time.time() - seconds
+    span.seconds = seconds
+    span.error = error
+    span.add(**counters)
+    _finish(span)
+
+
+def count(name, **counters):
+    """Adds counters to stage `name` without timing anything (cache lookups, for example)."""
+    _aggregate(name, counters={counter: value for counter, value in counters.items() if value})
+
+
+def current_span():
+    """The innermost running stage of this thread, or None."""
+    return _current.get()
+
+
+def snapshot():
+    """Returns the aggregated statistics as {stage: {count, errors, seconds, counters}}."""
+    with _lock:
+        return {name: {"count": s.count, "errors": s.errors, "seconds": s.seconds, "counters": dict(s.counters)}
+                for name, s in _stats.items()}
+
+
+def _metric_name(counter):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", counter)
+
+
+def prometheus_text():
+    """Renders the aggregated statistics in the Prometheus text exposition format."""
+    with _lock:
+        stats = sorted(_stats.items())
+        lines = ["# HELP rajapinnat_stage_seconds Wall time of the stages.",
+                 "# TYPE rajapinnat_stage_seconds histogram"]
+        for name, s in stats:
+            if not s.count:
+                continue
+            for bound, cumulative in zip(BUCKETS, s.buckets):
+                lines.append(f'rajapinnat_stage_seconds_bucket{{stage="{name}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'rajapinnat_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {s.count}')
+            lines.append(f'rajapinnat_stage_seconds_sum{{stage="{name}"}} {s.seconds:.6f}')
+            lines.append(f'rajapinnat_stage_seconds_count{{stage="{name}"}} {s.count}')
+        lines += ["# HELP rajapinnat_stage_errors_total Stages that ended with an exception.",
+                  "# TYPE rajapinnat_stage_errors_total counter"]
+        lines += [f'rajapinnat_stage_errors_total{{stage="{name}"}} {s.errors}' for name, s in stats if s.count]
+        for counter in sorted({counter for _, s in stats for counter in s.counters}):
+            metric = f"rajapinnat_stage_{_metric_name(counter)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines += [f'{metric}{{stage="{name}"}} {s.counters[counter]:g}' for name, s in stats if counter in s.counters]
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path):
+    """Writes the Prometheus metrics to `path` (replacing it atomically)."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serves the metrics on http://host:port/metrics from a background thread and returns the server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200 if self.path.split("?")[0] in ("/", "/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def print_summary(out=None):
+    """Prints a per-stage table to `out` (stderr): calls, errors, total and mean time and the counters."""
+    out = out or sys.stderr
+    stats = snapshot()
+    if not stats:
+        return
+    print(f"\n{'stage':<22}{'calls':>7}{'errors':>7}{'total s':>10}{'mean ms':>10}  counters", file=out)
+    for name, s in sorted(stats.items(), key=lambda item: -item[1]["seconds"]):
+        mean = s["seconds"] / s["count"] * 1000 if s["count"] else 0.0
+        counters = ", ".join(f"{counter}={value:g}" for counter, value in sorted(s["counters"].items()))
+        print(f"{name:<22}{s['count']:>7}{s['errors']:>7}{s['seconds']:>10.2f}{mean:>10.1f}  {counters}", file=out)
+
+
+def _at_exit():
+    if METRICS_FILE:
+        write_metrics(METRICS_FILE)
+    if PROFILE:
+        print_summary()
+    if _trace is not None:
+        _trace.close()
+
+
+def _start_metrics_server():
+    # Worker processes started with spawn/forkserver import this module again and must not bind the port.
+    # While they re-import __main__, parent_process() is still None but _inheriting is set.
+    import multiprocessing
+
+    if multiprocessing.parent_process() is not None or getattr(multiprocessing.current_process(), "_inheriting", False):
+        return
+    try:
+        serve_metrics(METRICS_PORT)
+    except (OSError, ValueError) as e:
+        print(f"Warning: metrics not served on port {METRICS_PORT}: {e}", file=sys.stderr)
+
+
+atexit.register(_at_exit)
+if METRICS_PORT:
+    _start_metrics_server()
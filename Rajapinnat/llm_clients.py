@@ -0,0 +1,231 @@
+"""
+Shared, pooled API clients for the Rajapinnat scripts.
+
+Every provider gets exactly one client per process. The clients keep their
+HTTP connections alive (HTTP/2 when the optional `h2` package is installed),
+so repeated calls reuse the same TLS connection instead of opening a new one.
+The httpx clients of the SDKs also add the bytes they send and receive to
+the running instrumentation stage (see EVENT_HOOKS).
+
+Pool size and timeouts can be changed with environment variables:
+    LLM_POOL_SIZE        maximum number of connections per provider (default 10)
+    LLM_TIMEOUT          total request timeout in seconds (default 120)
+    LLM_CONNECT_TIMEOUT  connection timeout in seconds (default 10)
+
+The API endpoints can be pointed elsewhere, for example at the local mock
+server in mock_provider.py:
+    OPENAI_BASE_URL      default https://api.openai.com/v1
+    OPENROUTER_BASE_URL  default https://openrouter.ai/api/v1
+    GEMINI_BASE_URL      default: the Gemini SDK's own endpoint
+"""
+
+import os
+import threading
+import time
+
+from instrumentation import current_span, stage
+from request_scheduler import call
+
+POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "10"))
+TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _get_or_create(name, factory):
+    """Returns the cached client called `name`, creating it on first use."""
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _count_request(request):
+    """httpx event hook: adds the request body size to the running "api.*" stage."""
+    span = current_span()
+    if span is not None:
+        length = request.headers.get("Content-Length")
+        span.add(bytes_sent=int(length) if length and length.isdigit() else 0)
+
+
+def _count_response(response):
+    """httpx event hook: adds the response body size to the stage that sent the request."""
+    span = current_span()
+    if span is None:
+        return
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit():
+        span.add(bytes_received=int(length))
+    else:
+        # Chunked (e.g. streamed) answer: count the bytes as they are read
+        import httpx
+
+        class CountingStream(httpx.SyncByteStream):
+            def __init__(self, stream):
+                self._stream = stream
+
+            def __iter__(self):
+                for chunk in self._stream:
+                    # Mostly read after call() has returned, so counted in the stage reading it
+                    (current_span() or span).add(bytes_received=len(chunk))
+                    yield chunk
+
+            def close(self):
+                self._stream.close()
+
+        response.stream = CountingStream(response.stream)
+
+
+EVENT_HOOKS = {"request": [_count_request], "response": [_count_response]}
+
+
+def _httpx_args():
+    """Keyword arguments of httpx.Client() shared by all providers: pool size, timeouts, HTTP/2 and the hooks."""
+    import httpx
+
+    return {
+        "http2": _http2_available(),
+        "limits": httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        "timeout": httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT),
+        "event_hooks": EVENT_HOOKS,
+    }
+
+
+def _httpx_client():
+    """Creates a keep-alive httpx client for the OpenAI SDK."""
+    import httpx
+
+    return httpx.Client(**_httpx_args())
+
+
+def _gemini_connect_timeout(request):
+    """
+    httpx event hook: google.genai passes HttpOptions.timeout with every
+    request, which replaces the client's timeout including its connect part.
+    Put the connect timeout back.
+    """
+    timeout = request.extensions.get("timeout")
+    if timeout is not None:
+        request.extensions["timeout"] = {**timeout, "connect": CONNECT_TIMEOUT}
+
+
+def get_openai_client():
+    """Returns the shared OpenAI client."""
+    def factory():
+        from openai import OpenAI
+        # Retries are handled by request_scheduler
+        return OpenAI(base_url=OPENAI_BASE_URL, api_key=os.environ.get("OPENAI_API_KEY"),
+                      http_client=_httpx_client(), max_retries=0)
+    return _get_or_create("openai", factory)
+
+
+def get_openrouter_client():
+    """Returns the shared OpenRouter client (OpenAI compatible API)."""
+    def factory():
+        from openai import OpenAI
+        return OpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=os.environ.get("OPENROUTER_API_KEY"),
+            http_client=_httpx_client(),
+            max_retries=0,
+        )
+    return _get_or_create("openrouter", factory)
+
+
+def get_gemini_client():
+    """Returns the shared Gemini client. Reads GEMINI_API_KEY / GOOGLE_API_KEY like genai.Client()."""
+    def factory():
+        from google import genai
+        from google.genai import types
+        client_args = _httpx_args()
+        client_args["event_hooks"] = {"request": [_gemini_connect_timeout, *EVENT_HOOKS["request"]],
+                                      "response": EVENT_HOOKS["response"]}
+        return genai.Client(http_options=types.HttpOptions(base_url=GEMINI_BASE_URL, timeout=int(TIMEOUT * 1000),
+                                                           client_args=client_args))
+    return _get_or_create("gemini", factory)
+
+
+def get_http_session():
+    """Returns a shared requests.Session for the scripts that call the REST endpoints directly."""
+    def factory():
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    return _get_or_create("http", factory)
+
+
+def http_timeout():
+    """Timeout tuple for requests calls made with the shared session."""
+    return (CONNECT_TIMEOUT, TIMEOUT)
+
+
+def stream_chat_completion(client, out, provider="openai", **kwargs):
+    """
+    Sends a chat completion request with streaming enabled and writes each
+    text delta to `out` as soon as it arrives. The request is scheduled under
+    the "provider:model" rate limit.
+    Returns (full_text, stats) where stats holds the time to first token,
+    total time, completion tokens and tokens per second.
+    """
+    with stage(f"stream.{provider}", model=kwargs.get("model")) as span:
+        start = time.perf_counter()
+        first_token = None
+        parts = []
+        usage = None
+        stream = call(f"{provider}:{kwargs.get('model')}", client.chat.completions.create,
+                      stream=True, stream_options={"include_usage": True}, **kwargs)
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first_token is None:
+                    first_token = time.perf_counter()
+                out.write(delta)
+                out.flush()
+                parts.append(delta)
+        end = time.perf_counter()
+
+        # Fall back to counting chunks if the provider does not report usage
+        tokens = usage.completion_tokens if usage and usage.completion_tokens else len(parts)
+        first_token = first_token or end
+        generation_time = end - first_token
+        stats = {
+            "ttft": first_token - start,
+            "total": end - start,
+            "tokens": tokens,
+            "tokens_per_sec": tokens / generation_time if generation_time > 0 else 0.0,
+        }
+        span.add(completion_tokens=tokens, prompt_tokens=usage.prompt_tokens if usage else 0)
+        span.label(ttft=round(stats["ttft"], 3))
+    return "".join(parts), stats
+
+
+def format_stream_stats(stats):
+    return (f"time to first token {stats['ttft']:.2f}s, {stats['tokens']} tokens "
+            f"in {stats['total']:.2f}s ({stats['tokens_per_sec']:.1f} tokens/s)")
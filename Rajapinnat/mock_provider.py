@@ -0,0 +1,309 @@
+"""
+Local stand-in for the OpenAI and Gemini APIs, for measuring the scripts offline.
+
+The server answers the endpoints the scripts use with canned data after a
+configurable delay:
+    POST /v1/chat/completions          (also streamed as server-sent events)
+    POST /v1/images/generations        (the image URL points back to this server)
+    POST /v1/audio/transcriptions
+    POST /v1/audio/speech              (raw PCM)
+    POST /v1/embeddings
+    POST /v1beta/models/<model>:generateContent
+    POST /v1beta/models/<model>:streamGenerateContent
+    GET  /files/<name>                 (generated images)
+    GET  /stats                        (request counters)
+
+A share of the requests can be answered with 429 and a Retry-After header
+to exercise the retry logic. Point the scripts at the server with
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+    OPENROUTER_BASE_URL=http://127.0.0.1:8765/v1
+    GEMINI_BASE_URL=http://127.0.0.1:8765
+and any API key.
+
+Latency distributions are given as "fixed:MS", "uniform:MIN_MS:MAX_MS",
+"lognormal:MEDIAN_MS:SIGMA" or "exp:MEAN_MS".
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+WORDS = ("the model answers with plausible text so that tokens keep flowing through "
+         "the client while the benchmark measures latency and throughput").split()
+
+
+def parse_latency(spec):
+    """Returns a function that draws one delay in seconds from the distribution described by `spec`."""
+    kind, _, params = spec.partition(":")
+    numbers = [float(v) for v in params.split(":") if v] or [0.0]
+    seconds = numbers[0] / 1000
+    if kind == "fixed":
+        return lambda: seconds
+    if kind == "uniform":
+        high = numbers[1] / 1000 if len(numbers) > 1 else seconds
+        return lambda: random.uniform(seconds, high)
+    if kind == "lognormal":
+        sigma = numbers[1] if len(numbers) > 1 else 0.5
+        return lambda: random.lognormvariate(math.log(seconds), sigma) if seconds > 0 else 0.0
+    if kind == "exp":
+        return lambda: random.expovariate(1 / seconds) if seconds > 0 else 0.0
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockConfig:
+    """Behaviour of the mock server; can be changed while it runs."""
+
+    def __init__(self, latency="lognormal:200:0.5", token_delay=0.005, tokens=60,
+                 error_rate=0.0, retry_after=0.2, image_bytes=256 * 1024, speech_seconds=1.0):
+        self.latency = parse_latency(latency) if isinstance(latency, str) else latency
+        self.token_delay = token_delay  # seconds between streamed tokens
+        self.tokens = tokens  # tokens per answer
+        self.error_rate = error_rate  # share of requests answered with 429
+        self.retry_after = retry_after
+        self.image_bytes = image_bytes
+        self.speech_seconds = speech_seconds
+
+
+def _answer(tokens, json_output=False):
+    if json_output:
+        return json.dumps({"word": "mock", "definitions": [_answer(min(tokens, 12))],
+                           "synonyms": ["mock"], "antonyms": []})
+    return " ".join(WORDS[i % len(WORDS)] for i in range(tokens))
+
+
+def _embedding(text, dim=1536):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    rng = random.Random(seed)
+    return [rng.uniform(-1, 1) for _ in range(dim)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+    # Headers and body are separate writes; with Nagle and delayed ACKs every request would wait ~40 ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def _send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_bytes(self, data, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _send_event(self, payload):
+        data = (payload if isinstance(payload, str) else json.dumps(payload))
+        data = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_events(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _throttled(self):
+        """Answers with 429 for a configured share of the requests."""
+        if random.random() >= self.config.error_rate:
+            return False
+        self.server.count("429")
+        self._send_json({"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error",
+                                   "code": "rate_limit_exceeded", "status": "RESOURCE_EXHAUSTED"}},
+                        status=429, headers={"Retry-After": f"{self.config.retry_after:g}"})
+        return True
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/stats":
+            self._send_json(dict(self.server.counters))
+        elif path.startswith("/files/"):
+            self.server.count("download")
+            time.sleep(self.config.latency() / 4)
+            self._send_bytes(self.server.image, "image/png")
+        else:
+            self._send_json({"error": {"message": f"Unknown path {path}"}}, status=404)
+
+    def do_HEAD(self):
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._read_body()
+        routes = [
+            ("/chat/completions", self._chat),
+            ("/images/generations", self._images),
+            ("/audio/transcriptions", self._transcription),
+            ("/audio/speech", self._speech),
+            ("/embeddings", self._embeddings),
+            (":generateContent", self._gemini),
+            (":streamGenerateContent", self._gemini_stream),
+        ]
+        for suffix, handler in routes:
+            if path.endswith(suffix):
+                self.server.count(suffix.strip("/:"))
+                if self._throttled():
+                    return
+                time.sleep(self.config.latency())
+                handler(json.loads(body or b"{}") if "transcriptions" not in suffix else body)
+                return
+        self._send_json({"error": {"message": f"Unknown path {path}"}}, status=404)
+
+    def _chat(self, request):
+        model = request.get("model", "mock")
+        tokens = min(self.config.tokens, request.get("max_tokens") or self.config.tokens)
+        created = int(time.time())
+        if not request.get("stream"):
+            self._send_json({
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": _answer(tokens)}}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": tokens, "total_tokens": 10 + tokens},
+            })
+            return
+
+        self._start_events()
+        chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model}
+        for i in range(tokens):
+            delta = {"content": ("" if i == 0 else " ") + WORDS[i % len(WORDS)]}
+            self._send_event({**chunk, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+            time.sleep(self.config.token_delay)
+        self._send_event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._send_event({**chunk, "choices": [],
+                              "usage": {"prompt_tokens": 10, "completion_tokens": tokens, "total_tokens": 10 + tokens}})
+        self._send_event("[DONE]")
+        self._end_events()
+
+    def _images(self, request):
+        host, port = self.server.server_address[:2]
+        self._send_json({"created": int(time.time()), "data": [
+            {"url": f"http://{host}:{port}/files/{random.getrandbits(64):x}.png",
+             "revised_prompt": request.get("prompt", "")}
+            for _ in range(request.get("n") or 1)
+        ]})
+
+    def _transcription(self, body):
+        self._send_json({"text": _answer(min(self.config.tokens, 20))})
+
+    def _speech(self, request):
+        samples = int(24000 * self.config.speech_seconds)
+        self._send_bytes(bytes(2 * samples), "application/octet-stream")
+
+    def _embeddings(self, request):
+        inputs = request.get("input", "")
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        self._send_json({"object": "list", "model": request.get("model"), "data": [
+            {"object": "embedding", "index": i, "embedding": _embedding(text)} for i, text in enumerate(inputs)
+        ], "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+    def _gemini_response(self, text):
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                            "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": len(text.split()),
+                              "totalTokenCount": 10 + len(text.split())},
+            "modelVersion": "mock",
+        }
+
+    def _wants_json(self, request):
+        config = request.get("generationConfig") or {}
+        return config.get("responseMimeType") == "application/json"
+
+    def _gemini(self, request):
+        self._send_json(self._gemini_response(_answer(self.config.tokens, self._wants_json(request))))
+
+    def _gemini_stream(self, request):
+        self._start_events()
+        tokens = _answer(self.config.tokens, self._wants_json(request)).split(" ")
+        for i in range(0, len(tokens), 8):
+            text = (" " if i else "") + " ".join(tokens[i:i + 8])
+            self._send_event(self._gemini_response(text))
+            time.sleep(self.config.token_delay * 8)
+        self._end_events()
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.counters = Counter()
+        self._lock = threading.Lock()
+        # PNG signature followed by filler, about the size of a generated image
+        self.image = b"\x89PNG\r\n\x1a\n" + bytes(max(0, config.image_bytes - 8))
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """Starts the mock server in a background thread (port 0 picks a free port) and returns it."""
+    server = MockServer((host, port), config or MockConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the OpenAI and Gemini APIs for offline benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:200:0.5", help="Response latency distribution (see module docstring)")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="Seconds between streamed tokens")
+    parser.add_argument("--tokens", type=int, default=60, help="Tokens per generated answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--image-bytes", type=int, default=256 * 1024, help="Size of the generated images")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.token_delay, args.tokens, args.error_rate, args.retry_after, args.image_bytes)
+    server = MockServer((args.host, args.port), config)
+    print(f"Mock provider listening on {server.url}")
+    print(f"  OPENAI_BASE_URL={server.url}/v1 OPENROUTER_BASE_URL={server.url}/v1 GEMINI_BASE_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Collision-free naming for generated files.
+
+Numbered files are created with O_CREAT | O_EXCL, so two writers (threads
+or processes) can never end up with the same name and earlier results are
+never overwritten. Names are numbered like `image.png`, `image_1.png`,
+`image_2.png`, ...; the next number of each name is kept in an index file
+in the output directory, so finding a free name does not scan the
+directory. The index is only a hint: if another process got there first,
+the exclusive create fails and the next number is tried.
+
+With naming="hash" the files are named after a hash of their content
+instead, and saving the same content twice reuses the existing file.
+
+Existing files (such as images from image_store.py) can be added with
+link(), which hard-links them instead of writing another copy.
+
+Each saved file is recorded in `manifest.jsonl` together with the prompt
+that produced it.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+INDEX_FILE = ".output_index.json"
+MANIFEST_FILE = "manifest.jsonl"
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class OutputStore:
+    """Thread-safe writer of uniquely named output files in one directory."""
+
+    def __init__(self, directory=".", naming="counter"):
+        if naming not in ("counter", "hash"):
+            raise ValueError(f"Unknown naming scheme: {naming}")
+        self.directory = directory or "."
+        self.naming = naming
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._index_path = os.path.join(self.directory, INDEX_FILE)
+        self._manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        try:
+            with open(self._index_path, encoding="utf-8") as f:
+                self._index = json.load(f)
+        except (OSError, ValueError):
+            self._index = {}
+
+    def _numbered(self, name, number):
+        stem, ext = os.path.splitext(name)
+        return name if number == 0 else f"{stem}_{number}{ext}"
+
+    def _save_index(self):
+        tmp = f"{self._index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._index_path)
+
+    def _create(self, name):
+        """Creates the next free numbered variant of `name` exclusively. Returns (path, file descriptor)."""
+        with self._lock:
+            number = self._index.get(name, 0)
+            while True:
+                path = os.path.join(self.directory, self._numbered(name, number))
+                try:
+                    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o644)
+                    break
+                except FileExistsError:
+                    number += 1  # taken by an earlier run or another process
+            self._index[name] = number + 1
+            self._save_index()
+        return path, fd
+
+    @contextmanager
+    def open(self, name, prompt=None, **metadata):
+        """
+        Opens a new, uniquely named file for binary writing and yields (path, file).
+        The file is recorded in the manifest when the block finishes, and removed
+        if it raises.
+        """
+        path, fd = self._create(name)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield path, f
+        except BaseException:
+            os.remove(path)
+            raise
+        self.record(path, prompt, **metadata)
+
+    def save(self, data, name, prompt=None, **metadata):
+        """Writes `data` to a new file based on `name` and returns its path."""
+        if self.naming == "hash":
+            return self._save_by_hash(data, name, prompt, **metadata)
+        with self.open(name, prompt, **metadata) as (path, f):
+            f.write(data)
+        return path
+
+    def _save_by_hash(self, data, name, prompt, **metadata):
+        stem, ext = os.path.splitext(name)
+        path = os.path.join(self.directory, f"{stem}_{hashlib.sha256(data).hexdigest()[:16]}{ext}")
+        if not os.path.exists(path):
+            # Written under a temporary name and renamed, so nobody sees half a file. If two
+            # writers race, both rename identical content into place.
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        self.record(path, prompt, **metadata)
+        return path
+
+    def link(self, existing, name, prompt=None, **metadata):
+        """
+        Adds the file `existing` under a new name based on `name` as a hard
+        link, so identical files share their disk space (a copy where hard links
+        are not possible, such as across file systems). Returns the new path.
+        """
+        if self.naming == "hash":
+            stem, ext = os.path.splitext(name)
+            path = os.path.join(self.directory, f"{stem}_{_file_digest(existing)[:16]}{ext}")
+            if not os.path.exists(path):
+                self._link_into_place(existing, path)
+        else:
+            # Reserve the name exclusively, then atomically replace the empty file with the link
+            path, fd = self._create(name)
+            os.close(fd)
+            try:
+                self._link_into_place(existing, path)
+            except BaseException:
+                os.remove(path)
+                raise
+        self.record(path, prompt, **metadata)
+        return path
+
+    def _link_into_place(self, existing, path):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(existing, tmp)
+        except FileNotFoundError:
+            raise  # nothing to link; copying would fail as well
+        except OSError:
+            shutil.copyfile(existing, tmp)
+        os.replace(tmp, path)
+
+    def record(self, path, prompt=None, **metadata):
+        """Appends a manifest line for `path`."""
+        entry = {"file": os.path.basename(path), "prompt": prompt,
+                 "created": time.strftime("%Y-%m-%dT%H:%M:%S"), **metadata}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            # One write per line in append mode, so lines from other processes do not interleave
+            with open(self._manifest_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def manifest(self):
+        """Returns the manifest entries in the order they were written."""
+        if not os.path.exists(self._manifest_path):
+            return []
+        with open(self._manifest_path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
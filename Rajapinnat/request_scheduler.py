@@ -0,0 +1,311 @@
+"""
+Shared scheduler for API calls.
+
+Every call goes through `call(key, fn, ...)`, where `key` is "provider:model"
+(for example "openai:gpt-3.5-turbo"). The scheduler
+  - limits the request rate with one token bucket per key,
+  - retries rate limited (429), overloaded (5xx) and dropped requests with
+    exponential backoff and jitter, honouring Retry-After and the
+    x-ratelimit-* headers,
+  - opens a circuit breaker per provider after repeated failures (5xx
+    errors and dropped connections) so that a provider that is down is not
+    hammered with more requests. Rate limiting (429 or a Retry-After header)
+    is not a failure; it pauses the token bucket instead,
+  - records each call as an "api.<provider>" stage in instrumentation, with
+    the retries, the time spent waiting for the rate limit, the token usage
+    and the bytes sent and received (taken from requests responses here;
+    the SDK clients count theirs with the httpx event hooks in llm_clients).
+
+Rate limits can be set with set_rate() or with the RATE_LIMITS environment
+variable, e.g. RATE_LIMITS="openai=500,openai:dall-e-3=7,gemini=1000"
+(requests per minute).
+"""
+
+import os
+import random
+import re
+import threading
+import time
+
+from instrumentation import stage
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+CONNECTION_ERRORS = {
+    "ConnectionError", "Timeout", "TimeoutError", "APIConnectionError", "APITimeoutError",
+    "TransportError", "TimeoutException", "ChunkedEncodingError",
+}
+
+# Requests per minute when nothing else is configured
+DEFAULT_RATES = {"openai": 500, "openrouter": 200, "gemini": 1000}
+
+MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "5"))
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+
+class CircuitOpenError(Exception):
+    """Raised when a provider's circuit breaker is open."""
+
+
+def parse_duration(value):
+    """Parses durations such as '20', '1.5', '20ms', '6m0s' or '1h2m3s' into seconds."""
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def retry_delay_from_headers(headers):
+    """Returns the wait time the server asked for, or None."""
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        seconds = parse_duration(retry_after)
+        if seconds is not None:
+            return seconds
+        import email.utils  # HTTP dates are rare, keep the import off the startup path
+
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    # OpenAI style headers: wait for the exhausted limit to reset
+    for kind in ("requests", "tokens"):
+        if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}", ""))
+            if reset is not None:
+                return reset
+    return None
+
+
+def _status_and_headers(obj):
+    """Extracts the HTTP status and headers from a response or an SDK exception."""
+    status = getattr(obj, "status_code", None)
+    if status is None and isinstance(getattr(obj, "code", None), int):
+        status = obj.code  # google.genai errors
+    headers = getattr(obj, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(obj, "response", None), "headers", None)
+    return status, headers
+
+
+def _record_usage(span, result):
+    """Adds the token usage and transfer sizes of a successful call to its stage."""
+    usage = getattr(result, "usage", None)  # OpenAI SDK
+    if usage is not None:
+        span.add(prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                 completion_tokens=getattr(usage, "completion_tokens", 0) or 0)
+    usage = getattr(result, "usage_metadata", None)  # google.genai
+    if usage is not None:
+        span.add(prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+                 completion_tokens=getattr(usage, "candidates_token_count", 0) or 0)
+
+    request = getattr(result, "request", None)  # requests.Response
+    body = getattr(request, "body", None)
+    if isinstance(body, (bytes, bytearray, memoryview, str)):
+        span.add(bytes_sent=len(body))
+    length = getattr(result, "headers", {}).get("Content-Length") if hasattr(result, "status_code") else None
+    if length and length.isdigit():
+        span.add(bytes_received=int(length))
+    if hasattr(result, "status_code"):
+        span.label(status=result.status_code)
+
+
+def _is_connection_error(error):
+    return any(cls.__name__ in CONNECTION_ERRORS for cls in type(error).__mro__)
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Stops handing out tokens for `seconds` (used when the server reports an exhausted limit)."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets one trial call through after `reset_timeout`."""
+
+    def __init__(self, name, threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self.trial_running:
+                raise CircuitOpenError(f"Too many failed requests to {self.name}, "
+                                       f"not sending more for {max(remaining, 0):.0f}s")
+            self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+def _record_breaker(breaker, status, headers):
+    """Counts a retryable error for the breaker, unless it only says that the rate limit was hit."""
+    if status == 429 or (headers and (headers.get("Retry-After") or headers.get("retry-after-ms"))):
+        breaker.record_success()  # the provider is up; the bucket pause slows us down
+    else:
+        breaker.record_failure()
+
+
+class RequestScheduler:
+    def __init__(self, max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rates = dict(DEFAULT_RATES)
+        self.buckets = {}
+        self.breakers = {}
+        self.lock = threading.Lock()
+        for item in filter(None, os.getenv("RATE_LIMITS", "").split(",")):
+            key, _, per_minute = item.partition("=")
+            self.rates[key.strip()] = float(per_minute)
+
+    def set_rate(self, key, per_minute):
+        """Sets the rate limit (requests per minute) for a provider or a "provider:model" key."""
+        with self.lock:
+            self.rates[key] = per_minute
+            self.buckets.pop(key, None)
+
+    def _bucket(self, key):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                provider = key.split(":")[0]
+                per_minute = self.rates.get(key) or self.rates.get(provider) or 600
+                bucket = self.buckets[key] = TokenBucket(per_minute / 60.0)
+            return bucket
+
+    def _breaker(self, provider):
+        with self.lock:
+            breaker = self.breakers.get(provider)
+            if breaker is None:
+                breaker = self.breakers[provider] = CircuitBreaker(provider)
+            return breaker
+
+    def _backoff(self, attempt, headers):
+        server_delay = retry_delay_from_headers(headers)
+        if server_delay is not None:
+            return server_delay + random.uniform(0, 0.1 * server_delay + 0.1)
+        # Full jitter: a random delay up to the exponential cap
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, key, fn, *args, **kwargs):
+        """
+        Calls fn(*args, **kwargs) under the rate limit of `key` and retries it on
+        retryable errors. fn may also return a requests.Response; retryable status
+        codes are retried and the last response is returned if all attempts fail.
+        """
+        with stage(f"api.{key.split(':')[0]}", key=key) as span:
+            result = self._call(span, key, fn, *args, **kwargs)
+            _record_usage(span, result)
+            return result
+
+    def _call(self, span, key, fn, *args, **kwargs):
+        bucket = self._bucket(key)
+        breaker = self._breaker(key.split(":")[0])
+
+        # Checked once: a call that has started is allowed to finish its retries
+        breaker.before_call()
+        for attempt in range(self.max_retries + 1):
+            wait_start = time.perf_counter()
+            bucket.acquire()
+            span.add(queue_seconds=time.perf_counter() - wait_start)
+            try:
+                result = fn(*args, **kwargs)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                status, headers = _status_and_headers(e)
+                if status not in RETRY_STATUS and not _is_connection_error(e):
+                    breaker.record_success()  # the provider answered, the request itself was bad
+                    raise
+                _record_breaker(breaker, status, headers)
+                if attempt == self.max_retries:
+                    raise
+            else:
+                status, headers = _status_and_headers(result)
+                if status not in RETRY_STATUS:
+                    breaker.record_success()
+                    delay = retry_delay_from_headers(headers)
+                    if delay:
+                        bucket.pause(delay)  # the limit is used up, hold back the next request
+                    return result
+                _record_breaker(breaker, status, headers)
+                if attempt == self.max_retries:
+                    return result
+                close = getattr(result, "close", None)
+                if close is not None:
+                    close()  # a streamed response holds its pooled connection until closed
+
+            delay = self._backoff(attempt, headers)
+            span.add(retries=1, backoff_seconds=delay)
+            if status == 429:
+                bucket.pause(delay)
+            time.sleep(delay)
+
+
+_scheduler = RequestScheduler()
+
+
+def call(key, fn, *args, **kwargs):
+    """Runs an API call through the shared scheduler."""
+    return _scheduler.call(key, fn, *args, **kwargs)
+
+
+def set_rate(key, per_minute):
+    _scheduler.set_rate(key, per_minute)
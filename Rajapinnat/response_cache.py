@@ -0,0 +1,119 @@
+"""
+Persistent on-disk cache for model responses, stored in SQLite.
+
+Entries are addressed by a hash of the parts that determine the response
+(for example the normalized input, a hash of the prompt template and the
+model name). Old entries are dropped after `ttl` seconds and the least
+recently used entries are evicted when the cache grows past `max_entries`
+(in one batch, down to 90% of it, so that a put rarely has to evict).
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from instrumentation import count
+
+DEFAULT_TTL = 30 * 24 * 3600  # 30 days
+DEFAULT_MAX_ENTRIES = 50000
+EVICT_TO = 0.9  # share of max_entries kept after an eviction, so evictions stay rare
+
+
+def cache_dir():
+    """Returns the directory used for the scripts' caches (RAJAPINNAT_CACHE_DIR or ~/.cache/rajapinnat)."""
+    path = os.getenv("RAJAPINNAT_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "rajapinnat")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def make_key(*parts):
+    """Builds a content address from the given key parts."""
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite backed key/value cache with TTL and LRU eviction."""
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        # Approximate when other processes write too; recounted before evicting
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get(self, key):
+        """Returns the cached value for `key`, or None on a miss."""
+        start = time.perf_counter()
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._entries -= 1
+                row = None
+            if row is None:
+                self.misses += 1
+                count("cache.response", cache_misses=1)
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self.hit_seconds += time.perf_counter() - start
+            count("cache.response", cache_hits=1)
+            return row[0]
+
+    def put(self, key, value):
+        """Stores `value` under `key` and evicts the least recently used entries if the cache is full."""
+        now = time.time()
+        with self._lock:
+            updated = self._conn.execute(
+                "UPDATE entries SET value = ?, created = ?, accessed = ? WHERE key = ?", (value, now, now, key)
+            ).rowcount
+            if not updated:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                self._entries += 1
+            if self.max_entries and self._entries > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        """Deletes the least recently used entries down to EVICT_TO of max_entries. Called with the lock held."""
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        excess = self._entries - int(self.max_entries * EVICT_TO)
+        if self._entries > self.max_entries and excess > 0:
+            self._conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed LIMIT ?)", (excess,)
+            )
+            self._entries -= excess
+
+    def stats(self):
+        """Returns hit/miss statistics as a dict."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "avg_hit_us": self.hit_seconds / self.hits * 1e6 if self.hits else 0.0,
+            "entries": entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()